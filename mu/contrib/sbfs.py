@@ -62,13 +62,21 @@ def find_microbit():
 '''
 
 def read_until(serial, token, timeout=5000):
+    """
+    Read from the serial connection until the token has been received and
+    return everything read.
+
+    Only waits for more data when nothing is already buffered, and only
+    searches the newly read bytes (plus enough of the previous ones to find a
+    token split between reads).
+    """
     buff = bytearray()
     while True:
-        if not (serial.waitForReadyRead(timeout)):
+        if not serial.bytesAvailable() and not serial.waitForReadyRead(timeout):
             raise TimeoutError(_('Transfer synchronization processing failed'))
-        data = bytes(serial.readAll())  # get all the available bytes.
-        buff.extend(data)
-        if token in buff:
+        start = max(0, len(buff) - len(token) + 1)
+        buff.extend(serial.readAll())  # get all the available bytes.
+        if buff.find(token, start) != -1:
             break
     return buff
 
@@ -18,12 +18,22 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
 import sys
+import codecs
 import logging
 import csv
 import shutil
 import re
 from PyQt5 import QtCore
-from PyQt5.QtCore import QSize, QProcess, QTimer, Qt, QIODevice
+from PyQt5.QtCore import (
+    QSize,
+    QProcess,
+    QTimer,
+    Qt,
+    QIODevice,
+    QObject,
+    QThread,
+    pyqtSignal,
+)
 from PyQt5.QtSerialPort import QSerialPort
 from PyQt5.QtWidgets import (
     QHBoxLayout,
@@ -45,15 +55,56 @@ from PyQt5.QtWidgets import (
     QComboBox,
     QMessageBox,
 )
-from PyQt5.QtGui import QTextCursor
 from mu.resources import load_icon
+from mu.interface.themes import Font
 from multiprocessing import Process
+from serial import Serial
 from mu.logic import MODULE_DIR
 from mu.contrib import sbfs
 
 logger = logging.getLogger(__name__)
 
 
+#: The maximum number of lines kept in the read only log / output text areas.
+MAX_LOG_LINES = 5000
+
+
+#: The location of esptool when installed as a third party package.
+ESPTOOL_PATH = os.path.join(MODULE_DIR, "esptool.py")
+
+#: Matches each access point tuple in the output of a Wi-Fi scan.
+_AP_RE = re.compile(r"\((.*?)\)")
+#: Matches the quote and escape characters to be removed from an SSID.
+_SSID_CLEAN_RE = re.compile(r"['\\]")
+
+#: Icons for the modes listed in the mode selector, keyed by icon name.
+_ICON_CACHE = {}
+
+
+def tail(text, lines):
+    """
+    Return (at most) the referenced number of lines from the end of the text.
+    """
+    return "\n".join(text.rsplit("\n", lines)[-lines:])
+
+
+def has_files(path):
+    """
+    Return True if there's a file anywhere in the directory tree at path,
+    stopping as soon as the first one is found.
+
+    Entries are counted as os.walk would count them: a link to a directory
+    is a directory but isn't looked inside, and any other link is a file.
+    Only links need a stat to tell which they are.
+    """
+    with os.scandir(path) as entries:
+        return any(
+            not entry.is_dir()
+            or (not entry.is_symlink() and has_files(entry.path))
+            for entry in entries
+        )
+
+
 class ModeItem(QListWidgetItem):
     """
     Represents an available mode listed for selection.
@@ -66,7 +117,10 @@ class ModeItem(QListWidgetItem):
         self.icon = icon
         text = "{}\n{}".format(name, description)
         self.setText(text)
-        self.setIcon(load_icon(self.icon))
+        icon = _ICON_CACHE.get(self.icon)
+        if icon is None:
+            icon = _ICON_CACHE[self.icon] = load_icon(self.icon)
+        self.setIcon(icon)
 
 
 class ModeSelector(QDialog):
@@ -94,6 +148,8 @@ class ModeSelector(QDialog):
         self.mode_list.itemDoubleClicked.connect(self.select_and_accept)
         widget_layout.addWidget(self.mode_list)
         self.mode_list.setIconSize(QSize(48, 48))
+        # Populate and sort the list before it is repainted.
+        self.mode_list.setUpdatesEnabled(False)
         for name, item in modes.items():
             if not item.is_debugger:
                 litem = ModeItem(
@@ -102,6 +158,7 @@ class ModeSelector(QDialog):
                 if item.icon == current_mode:
                     self.mode_list.setCurrentItem(litem)
         self.mode_list.sortItems()
+        self.mode_list.setUpdatesEnabled(True)
         instructions = QLabel(
             _(
                 "Change mode at any time by clicking "
@@ -152,7 +209,9 @@ class LogWidget(QWidget):
         self.log_text_area = QPlainTextEdit()
         self.log_text_area.setReadOnly(True)
         self.log_text_area.setLineWrapMode(QPlainTextEdit.NoWrap)
-        self.log_text_area.setPlainText(log)
+        self.log_text_area.setFont(Font().load())
+        self.log_text_area.setMaximumBlockCount(MAX_LOG_LINES)
+        self.log_text_area.setPlainText(tail(log, MAX_LOG_LINES))
         widget_layout.addWidget(self.log_text_area)
 
 
@@ -244,38 +303,45 @@ class SBFirmwareFlasherWidget(QWidget):
     * Override MicroPython.
     """
 
+    #: Set once esptool has been found. A missing esptool isn't remembered
+    #: since it may be installed at any time via "Third Party Packages".
+    esptool_installed = False
+
+    error_msg = _(
+        "The ESP Firmware flasher requires the esptool "
+        "package to be installed.\n"
+        "Select \"Third Party Packages\", add 'esptool' "
+        "and click 'OK'"
+    )
+    instructions_title = _("How to flash MicroPython to your device")
+    instructions = _(
+        "&nbsp;1. Download firmware from the <br/>"
+        '&nbsp;&nbsp;&nbsp;&nbsp;<a href="https://www.artec-kk.co.jp/artecrobo2/data/mp/micropython.bin">'
+        "https://www.artec-kk.co.jp/artecrobo2/data/mp/micropython.bin</a><br/>"
+        "&nbsp;2. Connect your device<br/>"
+        "&nbsp;3. Load the .bin file below using the 'Browse' button<br/>"
+        "&nbsp;4. Press 'Write firmware'"
+    )
+
     def setup(self):
         widget_layout = QVBoxLayout()
         self.setLayout(widget_layout)
 
         # Check whether esptool is installed, show error if not
-        esptool_installed = os.path.exists(MODULE_DIR + "/esptool.py")
-        if not esptool_installed:
-            error_msg = _(
-                "The ESP Firmware flasher requires the esptool "
-                "package to be installed.\n"
-                "Select \"Third Party Packages\", add 'esptool' "
-                "and click 'OK'"
+        if not SBFirmwareFlasherWidget.esptool_installed:
+            SBFirmwareFlasherWidget.esptool_installed = os.path.exists(
+                ESPTOOL_PATH
             )
-            error_label = QLabel(error_msg)
+        if not self.esptool_installed:
+            error_label = QLabel(self.error_msg)
             widget_layout.addWidget(error_label)
             return
 
         # Instructions
-        grp_instructions = QGroupBox(
-            _("How to flash MicroPython to your device")
-        )
+        grp_instructions = QGroupBox(self.instructions_title)
         grp_instructions_vbox = QVBoxLayout()
         grp_instructions.setLayout(grp_instructions_vbox)
-        instructions = _(
-            "&nbsp;1. Download firmware from the <br/>"
-            '&nbsp;&nbsp;&nbsp;&nbsp;<a href="https://www.artec-kk.co.jp/artecrobo2/data/mp/micropython.bin">'
-            "https://www.artec-kk.co.jp/artecrobo2/data/mp/micropython.bin</a><br/>"
-            "&nbsp;2. Connect your device<br/>"
-            "&nbsp;3. Load the .bin file below using the 'Browse' button<br/>"
-            "&nbsp;4. Press 'Write firmware'"
-        )
-        label = QLabel(instructions)
+        label = QLabel(self.instructions)
         label.setTextFormat(Qt.RichText)
         label.setTextInteractionFlags(Qt.TextBrowserInteraction)
         label.setOpenExternalLinks(True)
@@ -287,6 +353,7 @@ class SBFirmwareFlasherWidget(QWidget):
         firmware_label = QLabel(_("Firmware (.bin):"))
         self.txtFolder = QLineEdit()
         self.btnFolder = QPushButton(_("Browse"))
+        self.last_dir = os.getcwd()
         self.btnExec = QPushButton(_("Write firmware"))
         self.btnExec.setEnabled(False)
         form_set = QGridLayout()
@@ -299,10 +366,12 @@ class SBFirmwareFlasherWidget(QWidget):
         # Output area
         self.log_text_area = QPlainTextEdit()
         self.log_text_area.setReadOnly(True)
+        self.log_text_area.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.log_text_area.setFont(Font().load())
+        self.log_text_area.setMaximumBlockCount(MAX_LOG_LINES)
         form_set = QHBoxLayout()
         form_set.addWidget(self.log_text_area)
         widget_layout.addLayout(form_set)
-        widget_layout.addStretch()
 
         # Connect events
         self.txtFolder.textChanged.connect(self.firmware_path_changed)
@@ -311,26 +380,35 @@ class SBFirmwareFlasherWidget(QWidget):
 
     def show_folder_dialog(self):
         # open dialog and set to foldername
-        filename = QFileDialog.getOpenFileName(
+        filename, _filter = QFileDialog.getOpenFileName(
             self,
             "Select MicroPython firmware (.bin)",
-            os.path.expanduser("."),
+            self.last_dir,
             "Firmware (*.bin)",
         )
         if filename:
-            filename = filename[0].replace("/", os.sep)
+            # Start from the same folder the next time the dialog is opened.
+            self.last_dir = os.path.dirname(filename)
+            if os.sep != "/":
+                filename = filename.replace("/", os.sep)
             self.txtFolder.setText(filename)
 
     def update_firmware(self):
-        esptool = MODULE_DIR + "/esptool.py"
-        write_command = (
-            'python "{}" --baud 1500000 ' 'write_flash 0x20000 "{}"'
-        ).format(esptool, self.txtFolder.text())
+        write_args = [
+            ESPTOOL_PATH,
+            "--baud",
+            "1500000",
+            "write_flash",
+            "0x20000",
+            self.txtFolder.text(),
+        ]
 
-        self.commands = [write_command]
+        self.commands = [(sys.executable, write_args)]
         self.run_esptool()
 
     def run_esptool(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.input_buffer = ""
         self.process = QProcess(self)
         self.process.setProcessChannelMode(QProcess.MergedChannels)
         self.process.readyReadStandardError.connect(self.read_process)
@@ -338,9 +416,11 @@ class SBFirmwareFlasherWidget(QWidget):
         self.process.finished.connect(self.esptool_finished)
         self.process.errorOccurred.connect(self.esptool_error)
 
-        command = self.commands.pop(0)
-        self.log_text_area.appendPlainText(command + "\n")
-        self.process.start(command)
+        program, args = self.commands.pop(0)
+        self.log_text_area.appendPlainText(
+            "{} {}\n".format(program, " ".join(args))
+        )
+        self.process.start(program, args)
 
     def esptool_error(self, error_num):
         self.log_text_area.appendPlainText(
@@ -352,6 +432,10 @@ class SBFirmwareFlasherWidget(QWidget):
         """
         Called when the subprocess that executes 'esptool.py is finished.
         """
+        self.input_buffer += self.decoder.decode(b"", final=True)
+        if self.input_buffer:
+            self.append_lines([self.input_buffer])
+            self.input_buffer = ""
         # Exit if a command fails
         if exitCode != 0 or exitStatus == QProcess.CrashExit:
             self.log_text_area.appendPlainText("Error on flashing. Aborting.")
@@ -362,28 +446,29 @@ class SBFirmwareFlasherWidget(QWidget):
 
     def read_process(self):
         """
-        Read data from the child process and append it to the text area. Try
-        to keep reading until there's no more data from the process.
+        Read all the data currently available from the child process and
+        append the complete lines to the text area. A trailing incomplete line
+        is kept until the rest of it arrives. The incremental decoder holds on
+        to multi-byte characters split across reads.
         """
-        msg = ""
-        data = self.process.readAll()
-        if data:
-            try:
-                msg = data.data().decode("utf-8")
-                self.append_data(msg)
-            except UnicodeDecodeError:
-                pass
-            QTimer.singleShot(2, self.read_process)
+        data = bytearray()
+        while self.process.bytesAvailable():
+            data.extend(bytes(self.process.readAll()))
+        self.input_buffer += self.decoder.decode(bytes(data))
+        lines = self.input_buffer.splitlines(True)
+        if lines and not lines[-1].endswith("\n"):
+            self.input_buffer = lines.pop()
+        else:
+            self.input_buffer = ""
+        if lines:
+            self.append_lines(lines)
 
-    def append_data(self, msg):
+    def append_lines(self, lines):
         """
-        Add data to the end of the text area.
+        Add the referenced list of lines to the end of the text area.
         """
-        cursor = self.log_text_area.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        cursor.insertText(msg)
-        cursor.movePosition(QTextCursor.End)
-        self.log_text_area.setTextCursor(cursor)
+        text = "".join(lines)
+        self.log_text_area.appendPlainText("\n".join(text.splitlines()))
 
     def firmware_path_changed(self):
         if len(self.txtFolder.text()) > 0:
@@ -392,6 +477,249 @@ class SBFirmwareFlasherWidget(QWidget):
             self.btnExec.setEnabled(False)
 
 
+class ESP32PackagesManager(QObject):
+    """
+    Used to send the Wi-Fi and library installation commands of the
+    ESP32PackagesWidget to the connected device in a manner such that the UI
+    remains responsive.
+
+    Emits signals on success or failure of the different operations.
+    """
+
+    # Emitted with the list of SSIDs found by a Wi-Fi scan.
+    on_scan = pyqtSignal(list)
+    # Emitted with the new connection state when the device has connected to,
+    # or disconnected from, an access point.
+    on_connect = pyqtSignal(bool)
+    # Emitted with a dictionary of the result of installing each library.
+    on_install = pyqtSignal(dict)
+    # Emitted with a message and information when the Wi-Fi scan fails.
+    on_scan_fail = pyqtSignal(str, str)
+    # Emitted with a title and message when connecting or disconnecting fails.
+    on_connect_fail = pyqtSignal(str, str)
+    # Emitted with a title and message when installing the libraries fails.
+    on_install_fail = pyqtSignal(str, str)
+
+    # The code run on the device to install a library and report the result.
+    install_template = (
+        "try:\n"
+        " upip.install({0!r})\n"
+        " print('__OK__')\n"
+        "except Exception as e:\n"
+        " print('__ERR__', e)"
+    )
+
+    def __init__(self, target):
+        """
+        Initialise with the mode used to reboot the device.
+
+        The port of the device is found on the GUI thread and passed in with
+        each command, since finding it updates the mode's state.
+        """
+        super().__init__()
+        self.target = target
+        self.serial = None
+
+    def open_serial_link(self, port):
+        """
+        Creates a new serial link instance.
+
+        This is called from the thread containing this object's instance so
+        the QSerialPort belongs to that thread.
+        """
+        self.input_buffer = []
+        self.serial = QSerialPort()
+        self.serial.setPortName(port)
+        if self.serial.open(QIODevice.ReadWrite):
+            self.serial.setDataTerminalReady(True)
+            if not self.serial.isDataTerminalReady():
+                # Using pyserial as a 'hack' to open the port and set DTR
+                # as QtSerial does not seem to work on some Windows :(
+                # See issues #281 and #302 for details.
+                self.serial.close()
+                pyser = Serial(port)  # open serial port w/pyserial
+                pyser.dtr = True
+                pyser.close()
+                self.serial.open(QIODevice.ReadWrite)
+            self.serial.setBaudRate(115200)
+        else:
+            msg = _("Cannot connect to device on port {}").format(port)
+            raise IOError(msg)
+
+    def close_serial_link(self):
+        """
+        Close and clean up the currently open serial link.
+        """
+        if self.serial:
+            self.serial.close()
+            self.serial = None
+
+    def initialize(self, port):
+        """
+        Open this object's own serial link to the device on the port, reboot
+        it and leave it at the REPL prompt with slot 99 selected, as the
+        mode's initialize does. The mode's serial link is left alone, since
+        this runs in the manager's thread.
+        """
+        try:
+            self.open_serial_link(port)
+        except Exception as e:
+            logger.exception("Error opening serial in initialize: %s", e)
+            raise RuntimeError(_("Open Serial Error")) from e
+
+        try:
+            self.target.reboot_and_prompt(self.serial)
+        except Exception as e:
+            logger.exception("Error reboot in initialize: %s", e)
+            self.close_serial_link()
+            raise RuntimeError(_("Reboot Error")) from e
+
+        try:
+            self.target.reset_last_selected(self.serial)
+        except IOError as e:
+            logger.exception("Error reset slot in initialize: %s", e)
+            self.close_serial_link()
+            raise RuntimeError(_("Reset Error")) from e
+
+    def scan(self, port):
+        """
+        Initialize the device on the port and scan for Wi-Fi access points.
+        Emit the list of SSIDs found or emit a failure signal.
+        """
+        try:
+            # Initialize Studuino:bit, leaving the serial link open.
+            self.initialize(port)
+        except Exception as e:
+            if e.args[0] == _("Open Serial Error"):
+                self.on_scan_fail.emit(
+                    ESP32PackagesWidget.message,
+                    ESP32PackagesWidget.information,
+                )
+            else:
+                self.on_scan_fail.emit(
+                    e.args[0], _("Please connect the USB cable again.")
+                )
+            return
+
+        # Get AP Informations
+        command = [
+            "import network",
+            "sta = network.WLAN(network.STA_IF)",
+            "sta.active(True)",
+            "print(sta.scan())",
+        ]
+        try:
+            out, err = sbfs.send_cmd(command, self.serial)
+        except IOError as e:
+            logger.exception("Error in scan: %s", e)
+            self.close_serial_link()
+            self.on_scan_fail.emit(
+                _("Scan Error"), _("Please connect the USB cable again.")
+            )
+            return
+
+        # Collect SSIDs
+        out_str = str(out)
+        aps = _AP_RE.findall(out_str)
+        logger.info(aps)
+        ssids = [_SSID_CLEAN_RE.sub("", ap.split(",")[0][1:]) for ap in aps]
+
+        self.close_serial_link()
+        self.on_scan.emit(ssids)
+
+    def connect(self, port, connect, ssid, password):
+        """
+        Connect the device on the port to (or disconnect it from) the access
+        point with the referenced SSID. Emit the new connection state or emit
+        a failure signal.
+        """
+        # Serial port open
+        try:
+            self.open_serial_link(port)
+        except Exception as e:
+            self.on_connect_fail.emit(
+                _("Open Serial Error"), _("{0}".format(e))
+            )
+            return
+
+        if connect:
+            # Get AP Informations
+            connect_command = "sta.connect('" + ssid + "', '" + password + "')"
+            command = [
+                connect_command,
+                "while not sta.isconnected():\n pass",
+                "print(sta.ifconfig())",
+            ]
+        else:
+            command = [
+                "sta.disconnect()",
+                "while sta.isconnected():\n pass",
+                "print(sta.ifconfig())",
+            ]
+        try:
+            out, err = sbfs.send_cmd(command, self.serial)
+        except IOError as e:
+            self.close_serial_link()
+            self.on_connect_fail.emit(
+                _("Wi-Fi Connect Error"), _("{0}".format(e))
+            )
+            return
+
+        self.close_serial_link()
+        self.on_connect.emit(connect)
+
+    def install(self, port, libs):
+        """
+        Install the referenced list of libraries onto the device on the port
+        with upip. Emit the result for each library or emit a failure signal.
+        """
+        try:
+            self.open_serial_link(port)
+        except Exception as e:
+            self.on_install_fail.emit(
+                _("Open Serial Error"), _("{0}".format(e))
+            )
+            return
+
+        # Install all the libraries with a single command so that upip is
+        # only imported once and there's only one round trip to the device.
+        program = ["import upip"]
+        for lib in libs:
+            program.append(self.install_template.format(lib))
+        try:
+            out, err = sbfs.send_cmd(["\n".join(program)], self.serial)
+        except IOError as e:
+            self.close_serial_link()
+            self.on_install_fail.emit(
+                _("Wi-Fi Connect Error"), _("{0}".format(e))
+            )
+            return
+
+        # The output for each library ends with an __OK__ or __ERR__ line.
+        result = {}
+        output = []
+        pending = list(libs)
+        for line in out.decode("utf-8", "replace").splitlines():
+            if pending and line.startswith(("__OK__", "__ERR__")):
+                lib = pending.pop(0)
+                if line.startswith("__ERR__"):
+                    output.append(line.split(" ", 1)[-1])
+                text = "\n".join(output)
+                if line.startswith("__ERR__") or "Error" in text:
+                    result[lib] = "NG\n" + text + "\n"
+                else:
+                    result[lib] = "OK\n" + text + "\n"
+                output = []
+            else:
+                output.append(line)
+        error = err.decode("utf-8", "replace") if err else "\n".join(output)
+        for lib in pending:
+            result[lib] = "NG\n" + error + "\n"
+
+        self.close_serial_link()
+        self.on_install.emit(result)
+
+
 class ESP32PackagesWidget(QWidget):
     """
     Used for editing and displaying 3rd party packages installed via pip to be
@@ -407,27 +735,36 @@ class ESP32PackagesWidget(QWidget):
         " device's reset button and wait a few seconds"
         " before trying again."
     )
+    instructions_title = _("How to install MicroPython library to your device")
+    instructions = _(
+        "&nbsp;1. Connect your device<br/>"
+        "&nbsp;2. Press 'Wi-Fi Scan' in Wi-Fi Connection area<br/>"
+        "&nbsp;4. Select SSID from the combo box<br/>"
+        "&nbsp;5. Write password in the text area<br/>"
+        "&nbsp;6. Press 'Connect'<br/>"
+        "&nbsp;7. Write libraries you want install in Update/Install libraries area<br/>"
+        "&nbsp;8. Press 'Start'<br/>"
+    )
+
+    # Emitted with the device's port to start a Wi-Fi scan on it.
+    start_scan = pyqtSignal(str)
+    # Emitted with the device's port and the connection state wanted, SSID
+    # and password to connect it to (or disconnect it from) an access point.
+    start_connect = pyqtSignal(str, bool, str, str)
+    # Emitted with the device's port and the list of libraries to install.
+    start_install = pyqtSignal(str, list)
+    # Emitted when the command sent to the device has finished.
+    command_finished = pyqtSignal()
 
     def setup(self, target):
         widget_layout = QVBoxLayout()
         self.setLayout(widget_layout)
 
         # Instructions
-        grp_instructions = QGroupBox(
-            _("How to install MicroPython library to your device")
-        )
+        grp_instructions = QGroupBox(self.instructions_title)
         grp_instructions_vbox = QVBoxLayout()
         grp_instructions.setLayout(grp_instructions_vbox)
-        instructions = _(
-            "&nbsp;1. Connect your device<br/>"
-            "&nbsp;2. Press 'Wi-Fi Scan' in Wi-Fi Connection area<br/>"
-            "&nbsp;4. Select SSID from the combo box<br/>"
-            "&nbsp;5. Write password in the text area<br/>"
-            "&nbsp;6. Press 'Connect'<br/>"
-            "&nbsp;7. Write libraries you want install in Update/Install libraries area<br/>"
-            "&nbsp;8. Press 'Start'<br/>"
-        )
-        label = QLabel(instructions)
+        label = QLabel(self.instructions)
         label.setTextFormat(Qt.RichText)
         label.setTextInteractionFlags(Qt.TextBrowserInteraction)
         label.setOpenExternalLinks(True)
@@ -489,8 +826,6 @@ class ESP32PackagesWidget(QWidget):
         self.groupbox_install.setEnabled(False)
         widget_layout.addWidget(self.groupbox_install)
 
-        widget_layout.addStretch()
-
         # Set event
         self.button_scan.clicked.connect(self.scan)
         self.button_conn.toggled.connect(self.connect)
@@ -502,132 +837,78 @@ class ESP32PackagesWidget(QWidget):
         self.text_area.textChanged.connect(self.library_info_changed)
 
         self.target = target
+        self.busy = False  # Whether a command is being sent to the device.
+
+        # Commands are sent to the device from a separate thread.
+        self.manager_thread = QThread(self)
+        self.manager = ESP32PackagesManager(target)
+        self.manager.moveToThread(self.manager_thread)
+        self.start_scan.connect(self.manager.scan)
+        self.start_connect.connect(self.manager.connect)
+        self.start_install.connect(self.manager.install)
+        self.manager.on_scan.connect(self.on_scan)
+        self.manager.on_scan_fail.connect(self.on_scan_fail)
+        self.manager.on_connect.connect(self.on_connect)
+        self.manager.on_connect_fail.connect(self.on_connect_fail)
+        self.manager.on_install.connect(self.on_install)
+        self.manager.on_install_fail.connect(self.on_install_fail)
+        self.manager_thread.start()
 
-    def open_serial_link(self, port):
+    def scan(self):
         """
-        Creates a new serial link instance.
+        Clear the list of SSIDs and ask the device to scan for Wi-Fi access
+        points.
         """
-        self.input_buffer = []
-        self.serial = QSerialPort()
-        self.serial.setPortName(port)
-        if self.serial.open(QIODevice.ReadWrite):
-            self.serial.setDataTerminalReady(True)
-            if not self.serial.isDataTerminalReady():
-                # Using pyserial as a 'hack' to open the port and set DTR
-                # as QtSerial does not seem to work on some Windows :(
-                # See issues #281 and #302 for details.
-                self.serial.close()
-                pyser = serial.Serial(port)  # open serial port w/pyserial
-                pyser.dtr = True
-                pyser.close()
-                self.serial.open(QIODevice.ReadWrite)
-            self.serial.setBaudRate(115200)
-        else:
-            msg = _("Cannot connect to device on port {}").format(port)
-            raise IOError(msg)
+        self.list_ssid.clear()
+        port = self.find_port()
+        if port:
+            self.button_scan.setEnabled(False)
+            self.busy = True
+            self.start_scan.emit(port)
 
-    def close_serial_link(self):
+    def on_scan(self, ssids):
         """
-        Close and clean up the currently open serial link.
+        Display the SSIDs found by a Wi-Fi scan.
         """
-        if self.serial:
-            self.serial.close()
-            self.serial = None
-
-    def scan(self):
-        # Clear
-        self.list_ssid.clear()
-
-        try:
-            # Initialize Studuino:bit
-            self.target.initialize()
-        except Exception as e:
-            if e.args[0] == _("Open Serial Error"):
-                self.target.view.show_message(self.message, self.information)
-            else:
-                self.target.view.show_message(
-                    e.args[0], _("Please connect the USB cable again.")
-                )
-            return
-
-        # Serial port open
-        try:
-            device_port, serial_number = self.target.find_device()
-            self.open_serial_link(device_port)
-        except Exception as e:
-            self.target.view.show_message(self.message, self.information)
-            return
-
-        # Get AP Informations
-        command = [
-            "import network",
-            "sta = network.WLAN(network.STA_IF)",
-            "sta.active(True)",
-            "print(sta.scan())",
-        ]
-        try:
-            out, err = sbfs.send_cmd(command, self.serial)
-        except IOError as e:
-            logger.exception("Error in scan: %s", e)
-            self.target.view.show_message(
-                _("Scan Error"), _("Please connect the USB cable again.")
-            )
-            self.close_serial_link()
-            return
-
-        # Display SSIDs
-        aps = re.findall(r"\((.*?)\)", str(out))
-        logger.info(aps)
-        for ap in aps:
-            info = ap.split(",")
-            ssid = re.sub(r"['\\]", "", info[0][1:])
-            self.list_ssid.addItem(ssid)
+        # Detach the completer from the list while it is filled, so it only
+        # catches up once (setCompleter(None) would delete it).
+        completer = self.list_ssid.completer()
+        completer.setModel(None)
+        self.list_ssid.addItems(ssids)
+        completer.setModel(self.list_ssid.model())
+        self.button_scan.setEnabled(True)
+        self.finish_command()
 
-        self.close_serial_link()
+    def on_scan_fail(self, message, information):
+        """
+        Tell the user why the Wi-Fi scan failed.
+        """
+        self.target.view.show_message(message, information)
+        self.button_scan.setEnabled(True)
+        self.finish_command()
 
     def connect(self, connect):
-        # Serial port open
-        self.button_conn.setEnabled(False)
-        try:
-            device_port, serial_number = self.target.find_device()
-            self.open_serial_link(device_port)
-        except Exception as e:
-            QMessageBox.critical(
-                None,
-                _("Open Serial Error"),
-                _("{0}".format(e)),
-                QMessageBox.Yes,
-            )
-            self.button_conn.setEnabled(True)
-            return
-
-        if connect:
-            # Get AP Informations
-            connect_command = (
-                "sta.connect('"
-                + self.list_ssid.currentText()
-                + "', '"
-                + self.line_pwd.text()
-                + "')"
+        """
+        Ask the device to connect to (or disconnect from) the selected access
+        point.
+        """
+        port = self.find_port()
+        if port:
+            self.button_conn.setEnabled(False)
+            self.busy = True
+            self.start_connect.emit(
+                port,
+                connect,
+                self.list_ssid.currentText(),
+                self.line_pwd.text(),
             )
-            command = [
-                connect_command,
-                "while not sta.isconnected():\n pass",
-                "print(sta.ifconfig())",
-            ]
-            try:
-                out, err = sbfs.send_cmd(command, self.serial)
-            except IOError as e:
-                QMessageBox.critical(
-                    None,
-                    _("Wi-Fi Connect Error"),
-                    _("{0}".format(e)),
-                    QMessageBox.Yes,
-                )
-                self.close_serial_link()
-                self.button_conn.setEnabled(True)
-                return
 
+    def on_connect(self, connected):
+        """
+        Update the UI once the device has connected to, or disconnected from,
+        the access point.
+        """
+        if connected:
             self.button_conn.setEnabled(True)
             self.button_conn.setText(_("Disconnect"))
 
@@ -638,90 +919,78 @@ class ESP32PackagesWidget(QWidget):
             self.groupbox_install.setEnabled(True)
             self.library_info_changed()
         else:
-            # Get AP Informations
-            connect_command = (
-                "sta.connect('"
-                + self.list_ssid.currentText()
-                + "', '"
-                + self.line_pwd.text()
-                + "')"
-            )
-            command = [
-                "sta.disconnect()",
-                "while sta.isconnected():\n pass",
-                "print(sta.ifconfig())",
-            ]
-            try:
-                out, err = sbfs.send_cmd(command, self.serial)
-            except IOError as e:
-                QMessageBox.critical(
-                    None,
-                    _("Wi-Fi Connect Error"),
-                    _("{0}".format(e)),
-                    QMessageBox.Yes,
-                )
-                self.close_serial_link()
-                self.button_conn.setEnabled(True)
-                return
-
             self.button_conn.setText(_("Connect"))
             self.list_ssid.setEnabled(True)
             self.line_pwd.setEnabled(True)
             self.button_scan.setEnabled(True)
             self.groupbox_install.setEnabled(False)
+        self.finish_command()
 
-        self.close_serial_link()
+    def on_connect_fail(self, title, message):
+        """
+        Tell the user why connecting or disconnecting failed.
+        """
+        QMessageBox.critical(None, title, message, QMessageBox.Yes)
+        self.button_conn.setEnabled(True)
+        self.finish_command()
 
     def install(self):
-
+        """
+        Ask the device to install the libraries listed in the text area.
+        """
         libs = self.text_area.toPlainText()
         libs = libs.split("\n")
         libs = [l for l in libs if l != ""]
         logger.info(libs)
+        port = self.find_port()
+        if port:
+            self.button_inst.setEnabled(False)
+            self.busy = True
+            self.start_install.emit(port, libs)
 
-        try:
-            device_port, serial_number = self.target.find_device()
-            self.open_serial_link(device_port)
-        except Exception as e:
-            QMessageBox.critical(
-                None,
-                _("Open Serial Error"),
-                _("{0}".format(e)),
-                QMessageBox.Yes,
-            )
-            self.button_conn.setEnabled(True)
-            return
-
-        # Get AP Informations
-        result = {}
-        for lib in libs:
-            pip_command = "upip.install('" + lib + "')"
-            command = ["import upip", pip_command]
-            try:
-                out, err = sbfs.send_cmd(command, self.serial)
-            except IOError as e:
-                QMessageBox.critical(
-                    None,
-                    _("Wi-Fi Connect Error"),
-                    _("{0}".format(e)),
-                    QMessageBox.Yes,
-                )
-                self.close_serial_link()
-                self.button_conn.setEnabled(True)
-                return
+    def on_install(self, result):
+        """
+        Display the result of installing each library.
+        """
+        information = "".join(
+            "[{}]\n{}\n".format(lib, value) for lib, value in result.items()
+        )
+        self.target.view.show_message("UPIP Result", information)
+        self.library_info_changed()
+        self.finish_command()
 
-            if b"Error" in out:
-                result.update({lib: "NG\n" + str(out) + "\n"})
-            else:
-                result.update({lib: "OK\n" + str(out) + "\n"})
+    def on_install_fail(self, title, message):
+        """
+        Tell the user why installing the libraries failed.
+        """
+        QMessageBox.critical(None, title, message, QMessageBox.Yes)
+        self.library_info_changed()
+        self.finish_command()
 
-        information = ""
-        for key in result.keys():
-            information += "[" + key + "]\n" + result[key] + "\n"
+    def find_port(self):
+        """
+        Return the port of the connected device, found on this (the GUI)
+        thread. If there's no device tell the user and return None.
+        """
+        device_port, serial_number = self.target.find_device()
+        if not device_port:
+            self.target.view.show_message(self.message, self.information)
+        return device_port
 
-        self.target.view.show_message("UPIP Result", information)
+    def finish_command(self):
+        """
+        Note that the command sent to the device has finished.
+        """
+        self.busy = False
+        self.command_finished.emit()
 
-        self.close_serial_link()
+    def stop(self):
+        """
+        Stop the thread used to send commands to the device, once any command
+        in progress has finished.
+        """
+        self.manager_thread.quit()
+        self.manager_thread.wait()
 
     def wifi_info_changed(self):
         if (len(self.line_pwd.text()) > 0) and (
@@ -746,6 +1015,9 @@ class AdminDialog(QDialog):
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        # The result to close with once the device has finished, if closing
+        # had to wait for it.
+        self.closing_result = None
 
     def setup(self, log, settings, packages, mode):
         self.setMinimumSize(600, 400)
@@ -768,40 +1040,109 @@ class AdminDialog(QDialog):
         self.envar_widget.setup(settings.get("envars", ""))
         self.tabs.addTab(self.envar_widget, _("Python3 Environment"))
         self.log_widget.log_text_area.setFocus()
-
+        # The remaining tabs are only set up the first time they're shown.
+        self.pending_setup = {}
         self.esp32_widget = SBFirmwareFlasherWidget()
-        self.esp32_widget.setup()
         self.microbit_widget = MicrobitSettingsWidget()
-        self.microbit_widget.setup(
-            settings.get("minify", False), settings.get("microbit_runtime", "")
+        self.defer_setup(
+            self.microbit_widget,
+            settings.get("minify", False),
+            settings.get("microbit_runtime", ""),
         )
 
         if mode.name == "Artec Studuino:Bit MicroPython":
+            self.defer_setup(self.esp32_widget)
             self.tabs.addTab(self.esp32_widget, _("Firmware flasher"))
 
             self.esp32_package_widget = ESP32PackagesWidget()
-            self.esp32_package_widget.setup(mode)
+            self.defer_setup(self.esp32_package_widget, mode)
             self.tabs.addTab(
                 self.esp32_package_widget,
                 _("MicroPython Third Party Packages"),
             )
         else:
+            self.esp32_package_widget = None
             self.tabs.addTab(self.microbit_widget, _("BBC micro:bit Settings"))
         self.package_widget = PackagesWidget()
-        self.package_widget.setup(packages)
+        self.defer_setup(self.package_widget, packages)
         self.tabs.addTab(self.package_widget, _("Third Party Packages"))
+        self.tabs.currentChanged.connect(self.setup_tab)
+
+    def defer_setup(self, widget, *args):
+        """
+        Store the arguments needed to set up the referenced widget so the work
+        can be done when its tab is first shown.
+        """
+        self.pending_setup[widget] = args
+
+    def setup_tab(self, index):
+        """
+        Handler for when the current tab changes. Sets up the widget in the
+        tab with the referenced index if this hasn't already been done.
+        """
+        widget = self.tabs.widget(index)
+        args = self.pending_setup.pop(widget, None)
+        if args is not None:
+            widget.setup(*args)
+
+    def done(self, result):
+        """
+        Wait for any commands still being sent to the device to finish before
+        closing the dialog.
+
+        Rather than blocking the UI while a command (such as a upip install)
+        is still running, the dialog says it's waiting and closes once the
+        command has finished.
+        """
+        widget = self.esp32_package_widget
+        if widget is not None and widget not in self.pending_setup:
+            if widget.busy:
+                if self.closing_result is None:
+                    self.closing_result = result
+                    self.setEnabled(False)
+                    self.setWindowTitle(
+                        _("Mu Administration")
+                        + " - "
+                        + _("Waiting for the device to finish...")
+                    )
+                    widget.command_finished.connect(self.finish_closing)
+                return
+            widget.stop()
+        super().done(result)
+
+    def finish_closing(self):
+        """
+        Close the dialog, as asked for earlier, now the device has finished.
+        """
+        self.esp32_package_widget.command_finished.disconnect(
+            self.finish_closing
+        )
+        self.setEnabled(True)
+        self.done(self.closing_result)
 
     def settings(self):
         """
         Return a dictionary representation of the raw settings information
         generated by this dialog. Such settings will need to be processed /
         checked in the "logic" layer of Mu.
+
+        Widgets that were never shown can't have been changed, so their
+        original values are returned.
         """
+        if self.microbit_widget in self.pending_setup:
+            minify, runtime = self.pending_setup[self.microbit_widget]
+        else:
+            minify = self.microbit_widget.minify.isChecked()
+            runtime = self.microbit_widget.runtime_path.text()
+        if self.package_widget in self.pending_setup:
+            (packages,) = self.pending_setup[self.package_widget]
+        else:
+            packages = self.package_widget.text_area.toPlainText()
         return {
             "envars": self.envar_widget.text_area.toPlainText(),
-            "minify": self.microbit_widget.minify.isChecked(),
-            "microbit_runtime": self.microbit_widget.runtime_path.text(),
-            "packages": self.package_widget.text_area.toPlainText(),
+            "minify": minify,
+            "microbit_runtime": runtime,
+            "packages": packages,
         }
 
 
@@ -865,6 +1206,167 @@ class FindReplaceDialog(QDialog):
         return self.replace_all_flag.isChecked()
 
 
+class PackageRemover(QObject):
+    """
+    Used to delete the assets of third party packages in a thread of its own,
+    so that the UI remains responsive.
+
+    Emits a message for each package as it is removed and a signal once all
+    the packages are removed and the module directory is tidied up.
+    """
+
+    # Emitted with a message saying whether a package was removed.
+    on_remove = pyqtSignal(str)
+    # Emitted when all the packages have been removed.
+    on_finished = pyqtSignal()
+
+    def __init__(self, module_dir, pkg_dirs):
+        """
+        Initialise with the module directory and a dictionary of the packages
+        to remove and the locations of their metadata directories.
+        """
+        super().__init__()
+        self.module_dir = module_dir
+        self.pkg_dirs = pkg_dirs
+
+    def remove_packages(self):
+        """
+        Remove all the packages, then any directories left without files.
+        """
+        for package, info in self.pkg_dirs.items():
+            self.remove_package(package, info)
+        self.clean_module_dir()
+        self.on_finished.emit()
+
+    def remove_package(self, package, info):
+        """
+        Delete all the assets of the referenced package.
+        """
+        if info.endswith("dist-info"):
+            # Modern
+            record = os.path.join(info, "RECORD")
+            # The directories files were deleted from, with the names of the
+            # modules deleted from each so their bytecode can go too.
+            modules = {}
+            # RECORD paths use "/" separators on all platforms and are
+            # relative to the module directory unless they're outside it.
+            prefix = os.path.join(self.module_dir, "")
+            with open(record, newline="") as f:
+                for line in f:
+                    # Each line is "path,hash,size". Only a path
+                    # containing a comma needs csv's quote handling.
+                    if line.startswith('"'):
+                        path = next(csv.reader([line]))[0]
+                    else:
+                        path = line.split(",", 1)[0].rstrip("\r\n")
+                    if not path:
+                        continue
+                    if os.path.isabs(path):
+                        to_delete = path
+                    elif os.sep == "/":
+                        to_delete = prefix + path
+                    else:
+                        to_delete = prefix + path.replace("/", os.sep)
+                    try:
+                        os.unlink(to_delete)
+                    except Exception as ex:
+                        logger.error("Unable to remove: " + to_delete)
+                        logger.error(ex)
+                    directory, filename = os.path.split(to_delete)
+                    name, ext = os.path.splitext(filename)
+                    names = modules.setdefault(directory, set())
+                    if ext == ".py":
+                        names.add(name)
+            shutil.rmtree(info, ignore_errors=True)
+            for directory, names in modules.items():
+                self.remove_bytecode(directory, names)
+            # Other packages may put files in the same directories (e.g.
+            # namespace packages), so only those left empty are removed.
+            for directory in sorted(modules, key=len, reverse=True):
+                self.remove_empty_dirs(directory)
+            self.on_remove.emit("Removed {}\n".format(package))
+        else:
+            # Egg
+            try:
+                record = os.path.join(info, "installed-files.txt")
+                prefix = os.path.join(info, "")
+                with open(record) as f:
+                    files = f.readlines()
+                    for row in files:
+                        to_delete = prefix + row.strip()
+                        try:
+                            os.remove(to_delete)
+                        except Exception as ex:
+                            logger.error("Unable to remove: " + to_delete)
+                            logger.error(ex)
+                shutil.rmtree(info, ignore_errors=True)
+                # Some modules don't use the module name for the module
+                # directory (they use a lower case variant thereof). E.g.
+                # "Fom" vs. "fom".
+                normal_module = os.path.join(self.module_dir, package)
+                lower_module = os.path.join(self.module_dir, package.lower())
+                shutil.rmtree(normal_module, ignore_errors=True)
+                shutil.rmtree(lower_module, ignore_errors=True)
+                self.on_remove.emit("Removed {}\n".format(package))
+            except Exception as ex:
+                msg = (
+                    "UNABLE TO REMOVE PACKAGE: {} (check the logs for"
+                    " more information.)\n"
+                ).format(package)
+                self.on_remove.emit(msg)
+                logger.error("Unable to remove package: " + package)
+                logger.error(ex)
+
+    def remove_bytecode(self, directory, names):
+        """
+        Delete the compiled files cached for the named modules in the
+        directory, and the cache directory if that leaves it empty.
+        """
+        pycache = os.path.join(directory, "__pycache__")
+        try:
+            cached = os.listdir(pycache)
+        except OSError:
+            return
+        for filename in cached:
+            if filename.split(".", 1)[0] in names:
+                to_delete = os.path.join(pycache, filename)
+                try:
+                    os.unlink(to_delete)
+                except OSError as ex:
+                    logger.error("Unable to remove: " + to_delete)
+                    logger.error(ex)
+        try:
+            os.rmdir(pycache)
+        except OSError:
+            pass
+
+    def remove_empty_dirs(self, directory):
+        """
+        Remove the directory and then its parents for as long as they're
+        empty, stopping at the module directory.
+        """
+        module_dir = os.path.join(os.path.abspath(self.module_dir), "")
+        directory = os.path.abspath(directory)
+        while directory.startswith(module_dir):
+            try:
+                os.rmdir(directory)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    def clean_module_dir(self):
+        """
+        Clean any directories not containing files.
+        """
+        with os.scandir(self.module_dir) as entries:
+            for entry in entries:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir and not has_files(entry.path):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+
 class PackageDialog(QDialog):
     """
     Display a dialog to indicate the status of the packaging related changes
@@ -873,6 +1375,11 @@ class PackageDialog(QDialog):
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.pending_data = []  # Output waiting to be added to the text area.
+        # Keeps multi-byte characters split across reads from pip intact.
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.partial_line = ""  # Output not yet ended by a newline.
+        self.remove_thread = None  # Removes packages off the UI thread.
 
     def setup(self, to_remove, to_add, module_dir):
         """
@@ -892,6 +1399,8 @@ class PackageDialog(QDialog):
         self.text_area = QPlainTextEdit()
         self.text_area.setReadOnly(True)
         self.text_area.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.text_area.setFont(Font().load())
+        self.text_area.setMaximumBlockCount(MAX_LOG_LINES)
         widget_layout.addWidget(self.text_area)
         # Buttons.
         self.button_box = QDialogButtonBox(QDialogButtonBox.Ok)
@@ -909,120 +1418,72 @@ class PackageDialog(QDialog):
         Work out which packages need to be removed and then kick off their
         removal.
         """
-        dirs = [
-            os.path.join(self.module_dir, d)
-            for d in os.listdir(self.module_dir)
-            if d.endswith("dist-info") or d.endswith("egg-info")
-        ]
+        # Metadata directories are named "<name>-<version>.dist-info" (or
+        # egg-info) where the name is normalised and so contains no "-".
+        installed = {}
+        with os.scandir(self.module_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(("dist-info", "egg-info")):
+                    name = entry.name.split("-", 1)[0].lower()
+                    installed[name] = entry.path
         self.pkg_dirs = {}
         for pkg in self.to_remove:
-            for d in dirs:
-                # Assets on the filesystem use a normalised package name.
-                pkg_name = pkg.replace("-", "_").lower()
-                if os.path.basename(d).lower().startswith(pkg_name + "-"):
-                    self.pkg_dirs[pkg] = d
+            # Assets on the filesystem use a normalised package name.
+            pkg_name = pkg.replace("-", "_").lower()
+            if pkg_name in installed:
+                self.pkg_dirs[pkg] = installed[pkg_name]
         if self.pkg_dirs:
-            # If there are packages to remove, schedule removal.
-            QTimer.singleShot(2, self.remove_package)
+            # If there are packages to remove, remove them in a new thread.
+            self.remove_thread = QThread(self)
+            self.remover = PackageRemover(self.module_dir, dict(self.pkg_dirs))
+            self.remover.moveToThread(self.remove_thread)
+            self.remove_thread.started.connect(self.remover.remove_packages)
+            self.remover.on_remove.connect(self.append_data)
+            self.remover.on_finished.connect(self.on_remove_finished)
+            self.remove_thread.start()
+
+    def on_remove_finished(self):
+        """
+        Called when all the packages to be removed are gone.
+        """
+        self.remove_thread.quit()
+        self.pkg_dirs = {}
+        # Check for end state.
+        if not (self.to_add or self.process):
+            self.end_state()
 
-    def remove_package(self):
+    def done(self, result):
         """
-        Take a package from the pending packages to be removed, delete all its
-        assets and schedule the removal of the remaining packages. If there are
-        no packages to remove, move to the finished state.
+        Make sure any package removal in progress completes before the dialog
+        is closed.
         """
-        if self.pkg_dirs:
-            package, info = self.pkg_dirs.popitem()
-            if info.endswith("dist-info"):
-                # Modern
-                record = os.path.join(info, "RECORD")
-                with open(record) as f:
-                    files = csv.reader(f)
-                    for row in files:
-                        to_delete = os.path.join(self.module_dir, row[0])
-                        try:
-                            os.remove(to_delete)
-                        except Exception as ex:
-                            logger.error("Unable to remove: " + to_delete)
-                            logger.error(ex)
-                shutil.rmtree(info, ignore_errors=True)
-                # Some modules don't use the module name for the module
-                # directory (they use a lower case variant thereof). E.g.
-                # "Fom" vs. "fom".
-                normal_module = os.path.join(self.module_dir, package)
-                lower_module = os.path.join(self.module_dir, package.lower())
-                shutil.rmtree(normal_module, ignore_errors=True)
-                shutil.rmtree(lower_module, ignore_errors=True)
-                self.append_data("Removed {}\n".format(package))
-            else:
-                # Egg
-                try:
-                    record = os.path.join(info, "installed-files.txt")
-                    with open(record) as f:
-                        files = f.readlines()
-                        for row in files:
-                            to_delete = os.path.join(info, row.strip())
-                            try:
-                                os.remove(to_delete)
-                            except Exception as ex:
-                                logger.error("Unable to remove: " + to_delete)
-                                logger.error(ex)
-                    shutil.rmtree(info, ignore_errors=True)
-                    # Some modules don't use the module name for the module
-                    # directory (they use a lower case variant thereof). E.g.
-                    # "Fom" vs. "fom".
-                    normal_module = os.path.join(self.module_dir, package)
-                    lower_module = os.path.join(
-                        self.module_dir, package.lower()
-                    )
-                    shutil.rmtree(normal_module, ignore_errors=True)
-                    shutil.rmtree(lower_module, ignore_errors=True)
-                    self.append_data("Removed {}\n".format(package))
-                except Exception as ex:
-                    msg = (
-                        "UNABLE TO REMOVE PACKAGE: {} (check the logs for"
-                        " more information.)"
-                    ).format(package)
-                    self.append_data(msg)
-                    logger.error("Unable to remove package: " + package)
-                    logger.error(ex)
-            QTimer.singleShot(2, self.remove_package)
-        else:
-            # Clean any directories not containing files.
-            dirs = [
-                os.path.join(self.module_dir, d)
-                for d in os.listdir(self.module_dir)
-            ]
-            for d in dirs:
-                keep = False
-                for entry in os.walk(d):
-                    if entry[2]:
-                        keep = True
-                if not keep:
-                    shutil.rmtree(d, ignore_errors=True)
-            # Remove the bin directory (and anything in it) since we don't
-            # use these assets.
-            shutil.rmtree(
-                os.path.join(self.module_dir, "bin"), ignore_errors=True
-            )
-            # Check for end state.
-            if not (self.to_add or self.process):
-                self.end_state()
+        if self.remove_thread:
+            self.remove_thread.quit()
+            self.remove_thread.wait()
+        super().done(result)
 
     def end_state(self):
         """
         Set the UI to a valid end state.
         """
-        self.append_data("\nFINISHED")
+        # Remove the bin directory (and anything in it) since we don't
+        # use these assets.
+        bin_dir = os.path.join(self.module_dir, "bin")
+        if os.path.isdir(bin_dir):
+            shutil.rmtree(bin_dir, ignore_errors=True)
+        self.append_data("\nFINISHED\n")
         self.button_box.button(QDialogButtonBox.Ok).setEnabled(True)
 
     def run_pip(self):
         """
-        Run a pip command in a subprocess and pipe the output to the dialog's
-        text area.
+        Run a pip command in a subprocess to install all the packages to be
+        added and pipe the output to the dialog's text area.
         """
-        package = self.to_add.pop()
-        args = ["-m", "pip", "install", package, "--target", self.module_dir]
+        packages = sorted(self.to_add)
+        self.to_add.clear()
+        self.append_data("Installing: {}\n".format(", ".join(packages)))
+        args = ["-m", "pip", "install", "--progress-bar", "off"]
+        args += packages + ["--target", self.module_dir]
         self.process = QProcess(self)
         self.process.setProcessChannelMode(QProcess.MergedChannels)
         self.process.readyRead.connect(self.read_process)
@@ -1032,32 +1493,48 @@ class PackageDialog(QDialog):
 
     def finished(self):
         """
-        Called when the subprocess that uses pip to install a package is
+        Called when the subprocess that uses pip to install the packages is
         finished.
         """
-        if self.to_add:
-            self.process = None
-            self.run_pip()
-        else:
-            if not self.pkg_dirs:
-                self.end_state()
+        remainder = self.decoder.decode(b"", final=True)
+        if remainder:
+            self.append_data(remainder)
+        self.process = None
+        if not self.pkg_dirs:
+            self.end_state()
 
     def read_process(self):
         """
-        Read data from the child process and append it to the text area. Try
-        to keep reading until there's no more data from the process.
+        Read all the data currently available from the child process and
+        append it to the text area. Called whenever more data is ready.
         """
-        data = self.process.readAll()
-        if data:
-            self.append_data(data.data().decode("utf-8"))
-            QTimer.singleShot(2, self.read_process)
+        data = bytearray()
+        while self.process.bytesAvailable():
+            data.extend(self.process.readAll())
+        msg = self.decoder.decode(data)
+        if msg:
+            self.append_data(msg)
 
     def append_data(self, msg):
         """
         Add data to the end of the text area.
+
+        Data is collected and added at most once per screen refresh (every
+        16ms) rather than on every call.
+        """
+        if not self.pending_data:
+            QTimer.singleShot(16, self.flush_data)
+        self.pending_data.append(msg)
+
+    def flush_data(self):
+        """
+        Add the pending data to the end of the text area.
+
+        Since appendPlainText always starts a new line, an incomplete last
+        line is held back until the rest of it arrives.
         """
-        cursor = self.text_area.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        cursor.insertText(msg)
-        cursor.movePosition(QTextCursor.End)
-        self.text_area.setTextCursor(cursor)
+        lines = (self.partial_line + "".join(self.pending_data)).split("\n")
+        self.pending_data = []
+        self.partial_line = lines.pop()
+        if lines:
+            self.text_area.appendPlainText("\n".join(lines))
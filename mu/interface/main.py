@@ -321,6 +321,7 @@ class Window(QMainWindow):
     close_serial = pyqtSignal()
     write_to_serial = pyqtSignal(bytes)
     data_received = pyqtSignal(bytes)
+    serial_disconnected = pyqtSignal()
     open_file = pyqtSignal(str)
     load_theme = pyqtSignal(str)
     previous_folder = None
@@ -511,6 +512,19 @@ class Window(QMainWindow):
         data = bytes(self.serial.readAll())  # get all the available bytes.
         self.data_received.emit(data)
 
+    def on_serial_error(self, error):
+        """
+        Called when an error occurs on the serial connection. If the device
+        has gone away (e.g. it was unplugged) emit the serial_disconnected
+        signal.
+
+        The signal is emitted once control is back in the event loop, since
+        its handlers close (and so delete) the QSerialPort reporting the
+        error, and may show a modal dialog.
+        """
+        if error == QSerialPort.ResourceError:
+            QTimer.singleShot(0, self.serial_disconnected.emit)
+
     def on_stdout_write(self, data):
         """
         Called when either a running script or the REPL write to STDOUT.
@@ -537,6 +551,7 @@ class Window(QMainWindow):
                 self.serial.open(QIODevice.ReadWrite)
             self.serial.setBaudRate(115200)
             self.serial.readyRead.connect(self.on_serial_read)
+            self.serial.errorOccurred.connect(self.on_serial_error)
         else:
             msg = _("Cannot connect to device on port {}").format(port)
             raise IOError(msg)
@@ -547,6 +562,8 @@ class Window(QMainWindow):
         """
         if self.serial:
             self.serial.close()
+            # It may still be in one of its own signals, so let Qt delete it.
+            self.serial.deleteLater()
             self.serial = None
 
     def add_filesystem(self, home, file_manager, board_name="board"):
@@ -16,11 +16,11 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import json
 import os
 import os.path
 import csv
 import time
+import functools
 import logging
 import pkgutil
 from serial import Serial
@@ -29,6 +29,13 @@ from PyQt5.QtCore import QObject, pyqtSignal
 from mu.logic import HOME_DIRECTORY, WORKSPACE_NAME, get_settings_path
 from mu.contrib import microfs
 
+# Settings are parsed with orjson if it's installed (its decode errors are
+# ValueErrors, just like those from the standard library).
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as json_loads
+
 
 logger = logging.getLogger(__name__)
 
@@ -48,12 +55,59 @@ BOARD_IDS = set(
 )
 
 
-# Cache module names for filename shadow checking later.
-MODULE_NAMES = set([name for _, name, _ in pkgutil.iter_modules()])
-MODULE_NAMES.add("sys")
-MODULE_NAMES.add("builtins")
+@functools.lru_cache(maxsize=1)
+def get_module_names():
+    """
+    Return the names of the modules available to Python, for filename shadow
+    checking.
+
+    Finding them means looking through every entry on sys.path, so this is
+    only done the first time they are needed.
+    """
+    module_names = set([name for _, name, _ in pkgutil.iter_modules()])
+    module_names.add("sys")
+    module_names.add("builtins")
+    return frozenset(module_names)
+
+
+#: Number of seconds a scan of the serial ports is reused for, so toggling
+#: the REPL and plotter doesn't enumerate the ports each time.
+PORT_SCAN_TTL = 0.5
+_port_scan = {"time": None, "ports": ()}
+
 
+def get_available_ports():
+    """
+    Return a tuple of (vid, pid, port name, serial number) tuples for the
+    serial ports connected to the host computer.
 
+    The result of a scan is reused for PORT_SCAN_TTL seconds.
+    """
+    now = time.monotonic()
+    scanned = _port_scan["time"]
+    if scanned is None or now - scanned > PORT_SCAN_TTL:
+        _port_scan["ports"] = tuple(
+            (
+                port.vendorIdentifier(),
+                port.productIdentifier(),
+                port.portName(),
+                port.serialNumber(),
+            )
+            for port in QSerialPortInfo.availablePorts()
+        )
+        _port_scan["time"] = now
+    return _port_scan["ports"]
+
+
+def clear_available_ports():
+    """
+    Forget the last scan of the serial ports.
+    """
+    _port_scan["time"] = None
+    _port_scan["ports"] = ()
+
+
+@functools.lru_cache(maxsize=1)
 def get_default_workspace():
     """
     Return the location on the filesystem for opening and closing files.
@@ -61,13 +115,16 @@ def get_default_workspace():
     The default is to use a directory in the users home folder, however
     in some network systems this in inaccessible. This allows a key in the
     settings file to be used to set a custom path.
+
+    Mu never writes the settings file, so it is only read once. Call
+    get_default_workspace.cache_clear() to read it again.
     """
     sp = get_settings_path()
     workspace_dir = os.path.join(HOME_DIRECTORY, WORKSPACE_NAME)
     settings = {}
     try:
         with open(sp) as f:
-            settings = json.load(f)
+            settings = json_loads(f.read())
     except FileNotFoundError:
         logger.error("Settings file {} does not exist.".format(sp))
     except ValueError:
@@ -99,7 +156,6 @@ class BaseMode(QObject):
     save_timeout = 5  #: Number of seconds to wait before saving work.
     builtins = None  #: Symbols to assume as builtins when checking code style.
     file_extensions = []
-    module_names = MODULE_NAMES
     code_template = _("# Write your code here :-)")
 
     def __init__(self, editor, view):
@@ -107,6 +163,14 @@ class BaseMode(QObject):
         self.view = view
         super().__init__()
 
+    @property
+    def module_names(self):
+        """
+        The names of modules which mustn't be used as file names for source
+        code. Override in child classes for modules built into a device.
+        """
+        return get_module_names()
+
     def stop(self):
         """
         Called if/when the editor quits when in this mode. Override in child
@@ -192,13 +256,13 @@ class BaseMode(QObject):
         CSV data and is named with a timestamp for easy identification.
         """
         data_dir = os.path.join(get_default_workspace(), "data_capture")
-        if not os.path.exists(data_dir):
-            logger.debug("Creating directory: {}".format(data_dir))
-            os.makedirs(data_dir)
+        os.makedirs(data_dir, exist_ok=True)
         # Save the raw data as CSV
         filename = "{}.csv".format(time.strftime("%Y%m%d-%H%M%S"))
         f = os.path.join(data_dir, filename)
-        with open(f, "w") as csvfile:
+        # csv needs newline="" and a large buffer saves writing big captures
+        # to disk a few kilobytes at a time.
+        with open(f, "w", newline="", buffering=1 << 20) as csvfile:
             csv_writer = csv.writer(csvfile)
             csv_writer.writerows(self.view.plotter_pane.raw_data)
         self.view.remove_plotter()
@@ -248,23 +312,27 @@ class MicroPythonMode(BaseMode):
     valid_boards = BOARD_IDS
     force_interrupt = True
 
+    def __init__(self, editor, view):
+        super().__init__(editor, view)
+        # Split the known board IDs into exact matches and vendors matching
+        # any product, so each port is checked with set lookups.
+        self.board_ids = {
+            (vid, pid) for vid, pid in self.valid_boards if pid is not None
+        }
+        self.board_vids = {
+            vid for vid, pid in self.valid_boards if pid is None
+        }
+
     def find_device(self, with_logging=True):
         """
         Returns the port and serial number for the first MicroPython-ish device
         found connected to the host computer. If no device is found, returns
         the tuple (None, None).
         """
-        available_ports = QSerialPortInfo.availablePorts()
-        for port in available_ports:
-            pid = port.productIdentifier()
-            vid = port.vendorIdentifier()
+        available_ports = get_available_ports()
+        for vid, pid, port_name, serial_number in available_ports:
             # Look for the port VID & PID in the list of known board IDs
-            if (vid, pid) in self.valid_boards or (
-                vid,
-                None,
-            ) in self.valid_boards:
-                port_name = port.portName()
-                serial_number = port.serialNumber()
+            if (vid, pid) in self.board_ids or vid in self.board_vids:
                 if with_logging:
                     logger.info("Found device on port: {}".format(port_name))
                     logger.info("Serial number: {}".format(serial_number))
@@ -275,11 +343,9 @@ class MicroPythonMode(BaseMode):
             logger.debug(
                 [
                     "PID:0x{:04x} VID:0x{:04x} PORT:{}".format(
-                        p.productIdentifier(),
-                        p.vendorIdentifier(),
-                        p.portName(),
+                        pid, vid, port_name
                     )
-                    for p in available_ports
+                    for vid, pid, port_name, _serial in available_ports
                 ]
             )
         return (None, None)
@@ -508,13 +574,15 @@ class StuduinoBitFileManager(FileManager):
         Initialise with a port.
         """
         super().__init__(port)
+        self.serial = None
 
     def on_start(self):
         """
         Run when the thread containing this object's instance is started so
         it can emit the tree of files found on the connected device.
         """
-        # Create a new serial connection.
+        # Create a new serial connection, used for every file operation
+        # until close() is called.
         try:
             self.serial = Serial(self.port, 115200, timeout=1, parity="N")
             self.tree()
@@ -522,6 +590,14 @@ class StuduinoBitFileManager(FileManager):
             logger.exception(ex)
             self.on_list_fail.emit()
 
+    def close(self):
+        """
+        Close the serial connection to the Studuino:bit (if open).
+        """
+        if self.serial:
+            self.serial.close()
+            self.serial = None
+
     def tree(self):
         """
         Tree the files on the Studuino:bit. Emit the resulting tuple of
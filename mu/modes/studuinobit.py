@@ -19,11 +19,16 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import os
 import time
-from mu.modes.base import MicroPythonMode, StuduinoBitFileManager
+from mu.modes.base import (
+    MicroPythonMode,
+    StuduinoBitFileManager,
+    get_available_ports,
+)
 from mu.modes.api import STUDUINOBIT_APIS, SHARED_APIS
 from mu.interface.panes import CHARTS
-from PyQt5.QtCore import QIODevice, QThread, QTimer
+from PyQt5.QtCore import QIODevice, QThread
 from PyQt5.QtWidgets import (
+    QButtonGroup,
     QDialog,
     QGridLayout,
     QPushButton,
@@ -40,6 +45,9 @@ from PyQt5.QtSerialPort import QSerialPort
 
 logger = logging.getLogger(__name__)
 
+# Run as a single raw REPL command to set the slot run when the device starts.
+SET_LAST_SELECTED = 'import machine\nmachine.nvs_setint("lastSelected", {})'
+
 
 class StuduinoBitMode(MicroPythonMode):
     """
@@ -61,6 +69,32 @@ class StuduinoBitMode(MicroPythonMode):
         " device's reset button and wait a few seconds"
         " before trying again."
     )
+    # Shown when the REPL, plotter or file system is toggled on while another
+    # one is using the serial connection.
+    repl_fs_message = _("REPL and file system cannot work at the same time.")
+    repl_fs_information = _(
+        "The REPL and file system both use the same USB "
+        "serial connection. Only one can be active "
+        "at any time. Toggle the file system off and "
+        "try again."
+    )
+    plotter_fs_message = _(
+        "The plotter and file system cannot work at the same " "time."
+    )
+    plotter_fs_information = _(
+        "The plotter and file system both use the same "
+        "USB serial connection. Only one can be active "
+        "at any time. Toggle the file system off and "
+        "try again."
+    )
+    fs_repl_message = _(
+        "File system cannot work at the same time as the " "REPL or plotter."
+    )
+    fs_repl_information = _(
+        "The file system and the REPL and plotter "
+        "use the same USB serial connection. Toggle the "
+        "REPL and plotter off and try again."
+    )
 
     # There are many boards which use ESP microcontrollers but they often use
     # the same USB / serial chips (which actually define the Vendor ID and
@@ -70,16 +104,16 @@ class StuduinoBitMode(MicroPythonMode):
         (0x20A0, 0x4269)  # Studuion:bit VID, PID
     ]
 
+    # Seconds for which a found device is reused rather than searched for.
+    device_cache_ttl = 2
+
     def __init__(self, editor, view):
         super().__init__(editor, view)
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.is_connecting)
-
-    def actions(self):
-        """
-        Return an ordered list of actions provided by this module. An action
-        is a name (also used to identify the icon) , description, and handler.
-        """
+        self.device_cache = None  # (port, serial number, time found)
+        self.file_manager = None
+        self.file_manager_thread = None
+        self.view.serial_disconnected.connect(self.is_connecting)
+        # Built once, the toolbar and menus ask for these repeatedly.
         buttons = [
             {
                 "name": "run",
@@ -125,7 +159,14 @@ class StuduinoBitMode(MicroPythonMode):
                     "shortcut": "CTRL+Shift+P",
                 }
             )
-        return buttons
+        self.mode_actions = buttons
+
+    def actions(self):
+        """
+        Return an ordered list of actions provided by this module. An action
+        is a name (also used to identify the icon) , description, and handler.
+        """
+        return self.mode_actions
 
     def api(self):
         """
@@ -142,29 +183,44 @@ class StuduinoBitMode(MicroPythonMode):
 
                 if not (self.repl or self.plotter):
                     self.set_buttons(files_sb=True, flash_sb=True)
-                    if self.timer.isActive():
-                        self.timer.stop()
 
             elif not (self.repl):
                 # Add REPL
-                # time.sleep(1)
                 super().toggle_repl(event)
                 if self.repl:
                     self.set_buttons(files_sb=False, flash_sb=False)
 
-                    # アップデート時間設定
-                    if not self.timer.isActive():
-                        self.timer.start(1000)  # 1sごとにis_connectingを呼び出し
-
         else:
-            message = _("REPL and file system cannot work at the same time.")
-            information = _(
-                "The REPL and file system both use the same USB "
-                "serial connection. Only one can be active "
-                "at any time. Toggle the file system off and "
-                "try again."
+            self.view.show_message(
+                self.repl_fs_message, self.repl_fs_information
             )
-            self.view.show_message(message, information)
+
+    def find_device(self, with_logging=True):
+        """
+        Return the port and serial number of the connected Studuino:bit.
+
+        Operations such as running a script look for the device more than
+        once in quick succession, so a device found in the last
+        device_cache_ttl seconds is returned without searching again, as
+        long as its port is still there. The quiet once a second check for
+        plugged in devices always searches, so it never sees a stale result.
+        """
+        if not with_logging:
+            return super().find_device(with_logging)
+        now = time.monotonic()
+        if self.device_cache:
+            device_port, serial_number, found = self.device_cache
+            if now - found < self.device_cache_ttl and any(
+                self.port_path(port[2]) == device_port
+                for port in get_available_ports()
+            ):
+                return device_port, serial_number
+        device_port, serial_number = super().find_device(with_logging)
+        if device_port:
+            self.device_cache = (device_port, serial_number, now)
+        else:
+            self.device_cache = None
+        return device_port, serial_number
 
     def open_serial_link(self, port):
         """
@@ -176,19 +232,29 @@ class StuduinoBitMode(MicroPythonMode):
         if self.serial.open(QIODevice.ReadWrite):
             self.serial.setDataTerminalReady(True)
             if not self.serial.isDataTerminalReady():
-                # Using pyserial as a 'hack' to open the port and set DTR
-                # as QtSerial does not seem to work on some Windows :(
-                # See issues #281 and #302 for details.
-                self.serial.close()
-                pyser = serial.Serial(port)  # open serial port w/pyserial
-                pyser.dtr = True
-                pyser.close()
-                self.serial.open(QIODevice.ReadWrite)
+                self.set_dtr(port)
             self.serial.setBaudRate(115200)
+            # Never stop reading from the port because Qt's buffer is full,
+            # however much the device sends while rebooting.
+            self.serial.setReadBufferSize(0)
         else:
+            # The device may have gone, so look for it again next time.
+            self.device_cache = None
             msg = _("Cannot connect to device on port {}").format(port)
             raise IOError(msg)
 
+    def set_dtr(self, port):
+        """
+        Using pyserial as a 'hack' to open the port and set DTR as QtSerial
+        does not seem to work on some Windows :( See issues #281 and #302 for
+        details.
+        """
+        self.serial.close()
+        pyser = Serial(port)  # open serial port w/pyserial
+        pyser.dtr = True
+        pyser.close()
+        self.serial.open(QIODevice.ReadWrite)
+
     def close_serial_link(self):
         """
         Close and clean up the currently open serial link.
@@ -197,36 +263,60 @@ class StuduinoBitMode(MicroPythonMode):
             self.serial.close()
             self.serial = None
 
-    def read_until(self, token, timeout=5000):
+    def read_until(self, serial, token, timeout=5000):
+        """
+        Read from the serial link until the token has been received.
+
+        Only waits for more data when nothing is already buffered. What's
+        read isn't needed, so only enough of it to find a token split between
+        reads is kept.
+        """
         buff = bytearray()
         while True:
-            if not (self.serial.waitForReadyRead(timeout)):
-                raise TimeoutError(_("waitForReadyRead method timeout"))
+            if not serial.bytesAvailable():
+                if not serial.waitForReadyRead(timeout):
+                    raise TimeoutError(_("waitForReadyRead method timeout"))
 
-            data = bytes(self.serial.readAll())  # get all the available bytes.
-            buff.extend(data)
-            if token in buff:
+            buff.extend(serial.readAll())  # get all the available bytes.
+            if buff.find(token) != -1:
                 break
+            del buff[: max(0, len(buff) - len(token) + 1)]
+
+    def send(self, serial, data):
+        """
+        Write the data and hand it to the OS straight away, rather than when
+        Qt's event loop next gets round to it.
+        """
+        serial.write(data)
+        serial.flush()
 
     def reboot(self, serial):
-        serial.write(b"\x03")  # Ctrl+C
-        self.read_until(b">>> ")  # Read until prompt.
-        serial.write(b"\x01")  # Ctrl+A
-        serial.write("import machine\r\n".encode("utf-8"))
-        time.sleep(0.01)
-        serial.write("machine.reset()\r\n".encode("utf-8"))
-        time.sleep(0.01)
-        serial.write(b"\x04")
+        self.send(serial, b"\x03")  # Ctrl+C
+        self.read_until(serial, b">>> ")  # Read until prompt.
+        self.send(serial, b"\x01")  # Ctrl+A
+        # Wait for the raw REPL to be ready rather than sleeping.
+        self.read_until(serial, b"raw REPL; CTRL-B to exit\r\n>")
+        # Send the reset and Ctrl+D to run it in one go.
+        self.send(serial, b"import machine\r\nmachine.reset()\r\n\x04")
+        serial.waitForBytesWritten(1000)
         self.read_until(
+            serial,
             # b"Starting scheduler on PRO CPU"
-            b"Execute last selected script."
+            b"Execute last selected script.",
         )
 
     def reboot_and_prompt(self, serial):
         self.reboot(serial)
         # display prompt
-        serial.write(b"\x03")  # Ctrl+C
-        self.read_until(b">>> ")  # Read until prompt.
+        self.send(serial, b"\x03")  # Ctrl+C
+        self.read_until(serial, b">>> ")  # Read until prompt.
+
+    def reset_last_selected(self, serial):
+        """
+        Select slot 99, the one used for sending commands, as the script the
+        device runs when it next starts.
+        """
+        sbfs.execute([SET_LAST_SELECTED.format(99)], serial)
 
     def toggle_flash(self, event):
         def save():
@@ -245,7 +335,7 @@ class StuduinoBitMode(MicroPythonMode):
                 HOME_DIRECTORY,
                 WORKSPACE_NAME,
                 "studuinobit",
-                "usr" + reg_num + ".py",
+                "usr{}.py".format(reg_num),
             )
             save_and_encode(tab.text(), usr_file, tab.newline)
             return reg_num, usr_file
@@ -255,11 +345,7 @@ class StuduinoBitMode(MicroPythonMode):
             sbfs.put(usr_file, "usr/" + filename, serial)
 
         def restart(serial, reg_num):
-            set_start_index = [
-                "import machine",
-                'machine.nvs_setint("lastSelected", {0})'.format(reg_num),
-            ]
-            sbfs.execute(set_start_index, serial)
+            sbfs.execute([SET_LAST_SELECTED.format(reg_num)], serial)
             self.reboot(serial)
 
         # Serial port open
@@ -306,9 +392,6 @@ class StuduinoBitMode(MicroPythonMode):
 
         # send usr*.py target
         try:
-            # # for simple debug
-            # print('upload')
-            # time.sleep(1)
             upload(serial, usr_file)
         except Exception as e:
             logger.exception("Error upload in transfer: %s", e)
@@ -323,9 +406,6 @@ class StuduinoBitMode(MicroPythonMode):
 
         # restart
         try:
-            # # for simple debug
-            # print('restart')
-            # time.sleep(1)
             restart(serial, reg_num)
         except Exception as e:
             logger.exception("Error restart in transfer: %s", e)
@@ -350,25 +430,12 @@ class StuduinoBitMode(MicroPythonMode):
             super().toggle_plotter(event)
             if self.plotter:
                 self.set_buttons(files_sb=False, flash_sb=False)
-
-                # アップデート時間設定
-                if not self.timer.isActive():
-                    self.timer.start(1000)  # 1sごとにis_connectingを呼び出し
             elif not (self.repl or self.plotter):
                 self.set_buttons(files_sb=True, flash_sb=True)
-                if self.timer.isActive():
-                    self.timer.stop()
         else:
-            message = _(
-                "The plotter and file system cannot work at the same " "time."
+            self.view.show_message(
+                self.plotter_fs_message, self.plotter_fs_information
             )
-            information = _(
-                "The plotter and file system both use the same "
-                "USB serial connection. Only one can be active "
-                "at any time. Toggle the file system off and "
-                "try again."
-            )
-            self.view.show_message(message, information)
 
     def initialize(self):
         # Get serial port
@@ -383,9 +450,6 @@ class StuduinoBitMode(MicroPythonMode):
 
         # Reboot and wait prompt
         try:
-            # # for simple debug
-            # print('restart')
-            # time.sleep(1)
             self.reboot_and_prompt(serial)
         except Exception as e:
             logger.exception("Error reboot in run: %s", e)
@@ -393,12 +457,8 @@ class StuduinoBitMode(MicroPythonMode):
             raise RuntimeError(_("Reboot Error")) from e
 
         # Set start to send command
-        command = ["import machine", 'machine.nvs_setint("lastSelected", 99)']
         try:
-            # # for simple debug
-            # print('reset')
-            # time.sleep(1)
-            sbfs.execute(command, serial)
+            self.reset_last_selected(serial)
         except IOError as e:
             logger.exception("Error reset slot in run: %s", e)
             self.close_serial_link()
@@ -443,11 +503,15 @@ class StuduinoBitMode(MicroPythonMode):
             self.view.show_message(message, information)
             return
 
-        python_script = tab.text().replace("\r\n", "\n")
-        python_script = python_script.split("\n")
+        # Only "\n" and "\r\n" end a line. splitlines() would also split on
+        # characters such as form feeds, which can be in the script.
+        python_script = [
+            line[:-1] if line.endswith("\r") else line
+            for line in tab.text().split("\n")
+        ]
         # python_script.insert(0, 'print()')
 
-        logger.info(python_script)
+        logger.debug("Script lines: %d", len(python_script))
 
         if not self.repl:
             self.toggle_repl(None)
@@ -460,19 +524,11 @@ class StuduinoBitMode(MicroPythonMode):
         system navigator for the MicroPython device on or off.
         """
         if self.repl:
-            message = _(
-                "File system cannot work at the same time as the "
-                "REPL or plotter."
+            self.view.show_message(
+                self.fs_repl_message, self.fs_repl_information
             )
-            information = _(
-                "The file system and the REPL and plotter "
-                "use the same USB serial connection. Toggle the "
-                "REPL and plotter off and try again."
-            )
-            self.view.show_message(message, information)
         else:
             if self.fs is None:
-                # time.sleep(1)
                 self.add_fs()
                 if self.fs:
                     logger.info("Toggle filesystem on.")
@@ -515,6 +571,12 @@ class StuduinoBitMode(MicroPythonMode):
         Remove the file system navigator from the UI.
         """
         self.view.remove_filesystem()
+        if self.file_manager_thread:
+            # Release the serial port for the REPL, plotter and flashing once
+            # any file operation in progress has finished.
+            self.file_manager_thread.quit()
+            self.file_manager_thread.wait()
+            self.file_manager.close()
         self.file_manager = None
         self.file_manager_thread = None
         self.fs = None
@@ -554,25 +616,18 @@ class StuduinoBitMode(MicroPythonMode):
             self.view.show_message(self.message, self.information)
 
     def is_connecting(self):
-        device_port, serial_number = self.find_device()
-        if device_port:
-            pass
-        else:
-            self.timer.stop()
-            if self.repl:
-                self.toggle_repl(None)
-            if self.plotter:
-                self.toggle_plotter(None)
-            message = _("Could not find an attached device.")
-            information = _(
-                "Please make sure the device is plugged into this"
-                " computer.\n\nIt must have a version of"
-                " MicroPython (or CircuitPython) flashed onto it"
-                " before the REPL will work.\n\nFinally, press the"
-                " device's reset button and wait a few seconds"
-                " before trying again."
-            )
-            self.view.show_message(message, information)
+        """
+        Called when the device used by the REPL or plotter goes away. Close
+        them and let the user know.
+        """
+        self.device_cache = None
+        if not (self.repl or self.plotter):
+            return
+        if self.repl:
+            self.toggle_repl(None)
+        if self.plotter:
+            self.toggle_plotter(None)
+        self.view.show_message(self.message, self.information)
 
 
 class RegisterWindow(QDialog):
@@ -584,33 +639,30 @@ class RegisterWindow(QDialog):
         grid = QGridLayout()
         grid.setSpacing(10)
 
-        offset_v = 5
-        offset_h = 3
-        for i in range(10):
-            reg_fname = QLabel("usr" + str(i) + ".py")
+        # Slots 0-4 are in the first column and 5-9 in the fourth.
+        positions = [(i, 0) if i < 5 else (i - 5, 3) for i in range(10)]
+        # A single connection for all the buttons, identified by slot number.
+        self.buttons = QButtonGroup(self)
+        self.buttons.buttonClicked[int].connect(self.on_click)
+        for i, (row, column) in enumerate(positions):
             button = QPushButton("Transfer")
-            button.clicked.connect(self.on_click)
+            self.buttons.addButton(button, i)
             hbox = QHBoxLayout()
-            group_box = QGroupBox()
-            group_box.setTitle(str(i))
-
-            hbox.addWidget(reg_fname)
+            hbox.addWidget(QLabel("usr" + str(i) + ".py"))
             hbox.addWidget(button)
+            group_box = QGroupBox(str(i))
             group_box.setLayout(hbox)
-
-            if i > 4:
-                grid.addWidget(group_box, i - offset_v, offset_h)
-            else:
-                grid.addWidget(group_box, i, 0)
+            grid.addWidget(group_box, row, column)
 
         self.setLayout(grid)
         self.setWindowTitle("Select a slot to transfer.")
 
         self.parent = parent
 
-    def on_click(self):
-        sender = self.sender()
-        reg_number = sender.parent().title()
+    def on_click(self, reg_number):
+        """
+        Record the slot of the clicked button and close the dialog.
+        """
         self.register_info.append(reg_number)
         self.accept()
 
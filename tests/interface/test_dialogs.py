@@ -5,7 +5,9 @@ Tests for the user interface elements of Mu.
 import sys
 import os
 import pytest
+import tempfile
 import mu.interface.dialogs
+import mu.interface.themes
 from PyQt5.QtWidgets import QApplication, QDialog, QWidget, QDialogButtonBox
 from unittest import mock
 from mu.modes import PythonMode, CircuitPythonMode, MicrobitMode, DebugMode
@@ -33,6 +35,8 @@ def test_ModeItem_init():
         "mu.interface.dialogs.QListWidgetItem.setIcon", mock_icon
     ), mock.patch(
         "mu.interface.dialogs.load_icon", mock_load
+    ), mock.patch.dict(
+        "mu.interface.dialogs._ICON_CACHE", clear=True
     ):
         mi = mu.interface.dialogs.ModeItem(name, description, icon)
         assert mi.name == name
@@ -43,6 +47,25 @@ def test_ModeItem_init():
     mock_icon.assert_called_once_with(icon)
 
 
+def test_ModeItem_init_cached_icon():
+    """
+    Ensure the icon for a mode is only loaded from disk the first time a
+    ModeItem for it is created.
+    """
+    mock_load = mock.MagicMock(return_value="icon")
+    with mock.patch(
+        "mu.interface.dialogs.QListWidgetItem.setIcon"
+    ) as mock_icon, mock.patch(
+        "mu.interface.dialogs.load_icon", mock_load
+    ), mock.patch.dict(
+        "mu.interface.dialogs._ICON_CACHE", clear=True
+    ):
+        mu.interface.dialogs.ModeItem("a", "b", "icon_name")
+        mu.interface.dialogs.ModeItem("a", "b", "icon_name")
+    mock_load.assert_called_once_with("icon_name")
+    assert mock_icon.call_count == 2
+
+
 def test_ModeSelector_setup():
     """
     Ensure the ModeSelector dialog is setup properly given a list of modes.
@@ -68,6 +91,10 @@ def test_ModeSelector_setup():
                 ms.setup(modes, current_mode)
                 assert ms.setLayout.call_count == 1
     assert mock_item.call_count == 3
+    assert ms.mode_list.setUpdatesEnabled.call_args_list == [
+        mock.call(False),
+        mock.call(True),
+    ]
 
 
 def test_ModeSelector_select_and_accept():
@@ -110,6 +137,92 @@ def test_LogWidget_setup():
     lw.setup(log)
     assert lw.log_text_area.toPlainText() == log
     assert lw.log_text_area.isReadOnly()
+    font = mu.interface.themes.Font().load()
+    assert lw.log_text_area.font().family() == font.family()
+
+
+def test_LogWidget_setup_long_log():
+    """
+    Ensure only the tail end of a very long log is displayed.
+    """
+    log = "\n".join(
+        str(i) for i in range(mu.interface.dialogs.MAX_LOG_LINES + 10)
+    )
+    lw = mu.interface.dialogs.LogWidget()
+    lw.setup(log)
+    displayed = lw.log_text_area.toPlainText().split("\n")
+    assert len(displayed) == mu.interface.dialogs.MAX_LOG_LINES
+    assert displayed[0] == "10"
+    assert displayed[-1] == str(mu.interface.dialogs.MAX_LOG_LINES + 9)
+
+
+def test_tail():
+    """
+    Ensure tail returns at most the expected number of lines from the end of
+    the text.
+    """
+    assert mu.interface.dialogs.tail("a\nb\nc", 2) == "b\nc"
+    assert mu.interface.dialogs.tail("a\nb\nc", 5) == "a\nb\nc"
+
+
+def test_has_files():
+    """
+    Ensure has_files finds a file nested in the directory tree and stops
+    looking once it has.
+    """
+    tree = {
+        "top": [
+            dir_entry("top", "empty"),
+            dir_entry("top", "full"),
+            dir_entry("top", "unvisited"),
+        ],
+        os.path.join("top", "empty"): [],
+        os.path.join("top", "full"): [
+            dir_entry(os.path.join("top", "full"), "x.py", is_dir=False)
+        ],
+    }
+    visited = []
+
+    def scandir(path):
+        visited.append(path)
+        entries = mock.MagicMock()
+        entries.__enter__.return_value = tree[path]
+        return entries
+
+    with mock.patch("mu.interface.dialogs.os.scandir", scandir):
+        assert mu.interface.dialogs.has_files("top") is True
+        assert visited == [
+            "top",
+            os.path.join("top", "empty"),
+            os.path.join("top", "full"),
+        ]
+        empty = os.path.join("top", "empty")
+        assert mu.interface.dialogs.has_files(empty) is False
+    assert tree["top"][2].is_dir.call_count == 0
+
+
+def test_has_files_symlinks():
+    """
+    Links are counted as os.walk counts them: a link to a directory isn't
+    looked inside and any other link is a file.
+    """
+    with tempfile.TemporaryDirectory() as top:
+        full = os.path.join(top, "full")
+        os.mkdir(full)
+        open(os.path.join(full, "x.py"), "w").close()
+        linked = os.path.join(top, "linked")
+        os.mkdir(linked)
+        try:
+            os.symlink(full, os.path.join(linked, "full"))
+        except (OSError, NotImplementedError):
+            pytest.skip("Can't create symbolic links here.")
+        assert mu.interface.dialogs.has_files(linked) is False
+        assert not any(files for _root, _dirs, files in os.walk(linked))
+        broken = os.path.join(top, "broken")
+        os.mkdir(broken)
+        os.symlink(os.path.join(top, "gone"), os.path.join(broken, "gone"))
+        assert mu.interface.dialogs.has_files(broken) is True
+        assert any(files for _root, _dirs, files in os.walk(broken))
 
 
 def test_EnvironmentVariablesWidget_setup():
@@ -148,6 +261,423 @@ def test_PackagesWidget_setup():
     assert pw.text_area.toPlainText() == packages
 
 
+def test_SBFirmwareFlasherWidget_setup_esptool_check():
+    """
+    Ensure the check for esptool is only repeated until it has been found.
+    """
+    with mock.patch.object(
+        mu.interface.dialogs.SBFirmwareFlasherWidget,
+        "esptool_installed",
+        False,
+    ), mock.patch(
+        "mu.interface.dialogs.os.path.exists", side_effect=[False, True]
+    ) as mock_exists:
+        fw = mu.interface.dialogs.SBFirmwareFlasherWidget()
+        fw.setup()
+        assert not hasattr(fw, "txtFolder")
+        fw = mu.interface.dialogs.SBFirmwareFlasherWidget()
+        fw.setup()
+        assert fw.txtFolder.text() == ""
+        fw = mu.interface.dialogs.SBFirmwareFlasherWidget()
+        fw.setup()
+        assert mock_exists.call_count == 2
+
+
+def test_SBFirmwareFlasherWidget_read_process():
+    """
+    Ensure all the available output from esptool is read at once and only
+    complete lines are appended to the text area.
+    """
+    fw = mu.interface.dialogs.SBFirmwareFlasherWidget()
+    fw.log_text_area = mock.MagicMock()
+    fw.process = mock.MagicMock()
+    with mock.patch("mu.interface.dialogs.QProcess"):
+        fw.commands = [("python", ["esptool.py"])]
+        fw.run_esptool()
+    fw.process.bytesAvailable.side_effect = [5, 4, 0]
+    fw.process.readAll.side_effect = [b"foo\r\n", b"bar\xe2"]
+    fw.log_text_area.reset_mock()
+    fw.read_process()
+    fw.log_text_area.appendPlainText.assert_called_once_with("foo")
+    assert fw.input_buffer == "bar"
+    fw.process.bytesAvailable.side_effect = [3, 0]
+    fw.process.readAll.side_effect = [b"\x82\xac\n"]
+    fw.read_process()
+    fw.log_text_area.appendPlainText.assert_called_with("bar\u20ac")
+    assert fw.input_buffer == ""
+
+
+def test_SBFirmwareFlasherWidget_show_folder_dialog():
+    """
+    Ensure the selected firmware is shown and the next dialog starts in the
+    folder it was selected from.
+    """
+    fw = mu.interface.dialogs.SBFirmwareFlasherWidget()
+    fw.txtFolder = mock.MagicMock()
+    fw.last_dir = "start"
+    path = os.path.join("/", "foo", "bar.bin").replace(os.sep, "/")
+    mock_fd = mock.MagicMock()
+    mock_fd.getOpenFileName.return_value = (path, "Firmware (*.bin)")
+    with mock.patch("mu.interface.dialogs.QFileDialog", mock_fd):
+        fw.show_folder_dialog()
+        assert mock_fd.getOpenFileName.call_args[0][2] == "start"
+    fw.txtFolder.setText.assert_called_once_with(path.replace("/", os.sep))
+    assert fw.last_dir == os.path.dirname(path)
+
+
+def test_SBFirmwareFlasherWidget_show_folder_dialog_cancelled():
+    """
+    Ensure nothing changes if the user cancels the file dialog.
+    """
+    fw = mu.interface.dialogs.SBFirmwareFlasherWidget()
+    fw.txtFolder = mock.MagicMock()
+    fw.last_dir = "start"
+    mock_fd = mock.MagicMock()
+    mock_fd.getOpenFileName.return_value = ("", "")
+    with mock.patch("mu.interface.dialogs.QFileDialog", mock_fd):
+        fw.show_folder_dialog()
+    assert fw.txtFolder.setText.call_count == 0
+    assert fw.last_dir == "start"
+
+
+def test_SBFirmwareFlasherWidget_update_firmware():
+    """
+    Ensure esptool is run by the same Python interpreter that is running Mu.
+    """
+    fw = mu.interface.dialogs.SBFirmwareFlasherWidget()
+    fw.txtFolder = mock.MagicMock()
+    fw.txtFolder.text.return_value = "firmware.bin"
+    fw.run_esptool = mock.MagicMock()
+    fw.update_firmware()
+    program, args = fw.commands[0]
+    assert program == sys.executable
+    assert args[0] == mu.interface.dialogs.ESPTOOL_PATH
+    assert args[1:] == [
+        "--baud",
+        "1500000",
+        "write_flash",
+        "0x20000",
+        "firmware.bin",
+    ]
+    fw.run_esptool.assert_called_once_with()
+
+
+def test_SBFirmwareFlasherWidget_run_esptool():
+    """
+    Ensure the next esptool command is started with its arguments passed as
+    a list, so paths containing spaces are not split.
+    """
+    fw = mu.interface.dialogs.SBFirmwareFlasherWidget()
+    fw.log_text_area = mock.MagicMock()
+    fw.commands = [("python", ["esptool.py", "my firmware.bin"])]
+    with mock.patch("mu.interface.dialogs.QProcess"):
+        fw.run_esptool()
+    fw.process.start.assert_called_once_with(
+        "python", ["esptool.py", "my firmware.bin"]
+    )
+    assert fw.commands == []
+
+
+def test_ESP32PackagesManager_scan():
+    """
+    Ensure the SSIDs found by a Wi-Fi scan on the device are emitted.
+    """
+    target = mock.MagicMock()
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    pm.initialize = mock.MagicMock()
+    pm.serial = mock.MagicMock()
+    pm.close_serial_link = mock.MagicMock()
+    pm.on_scan = mock.MagicMock()
+    out = b"[(b'foo', b'\\x12', 1, -50, 3, False), (b'bar', b'\\x34', 6)]"
+    with mock.patch(
+        "mu.interface.dialogs.sbfs.send_cmd", return_value=(out, b"")
+    ) as mock_send:
+        pm.scan("COM0")
+    pm.initialize.assert_called_once_with("COM0")
+    assert mock_send.call_args[0][1] is pm.serial
+    pm.on_scan.emit.assert_called_once_with(["foo", "bar"])
+    pm.close_serial_link.assert_called_once_with()
+    assert target.initialize.call_count == 0
+
+
+def test_ESP32PackagesManager_scan_no_device():
+    """
+    If the device can't be initialized, ensure the failure signal is emitted
+    with a helpful message.
+    """
+    target = mock.MagicMock()
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    pm.initialize = mock.MagicMock(
+        side_effect=RuntimeError(_("Open Serial Error"))
+    )
+    pm.on_scan_fail = mock.MagicMock()
+    pm.scan("COM0")
+    pm.on_scan_fail.emit.assert_called_once_with(
+        mu.interface.dialogs.ESP32PackagesWidget.message,
+        mu.interface.dialogs.ESP32PackagesWidget.information,
+    )
+
+
+def test_ESP32PackagesManager_initialize():
+    """
+    The device is rebooted through the manager's own serial link, leaving the
+    link open and the mode's serial link alone.
+    """
+    target = mock.MagicMock()
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    serial = mock.MagicMock()
+
+    def open_serial_link(port):
+        pm.serial = serial
+
+    pm.open_serial_link = mock.MagicMock(side_effect=open_serial_link)
+    pm.initialize("COM0")
+    pm.open_serial_link.assert_called_once_with("COM0")
+    assert target.find_device.call_count == 0
+    target.reboot_and_prompt.assert_called_once_with(serial)
+    target.reset_last_selected.assert_called_once_with(serial)
+    assert target.initialize.call_count == 0
+    assert target.open_serial_link.call_count == 0
+    assert pm.serial is serial
+
+
+def test_ESP32PackagesManager_initialize_no_device():
+    """
+    If the serial link can't be opened an "Open Serial Error" is raised.
+    """
+    target = mock.MagicMock()
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    pm.open_serial_link = mock.MagicMock(side_effect=IOError("boom"))
+    with pytest.raises(RuntimeError) as ex:
+        pm.initialize("COM0")
+    assert ex.value.args[0] == _("Open Serial Error")
+
+
+def test_ESP32PackagesManager_initialize_reboot_fail():
+    """
+    If rebooting the device fails, the serial link is closed and a "Reboot
+    Error" is raised.
+    """
+    target = mock.MagicMock()
+    target.reboot_and_prompt.side_effect = TimeoutError("boom")
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    pm.open_serial_link = mock.MagicMock()
+    pm.close_serial_link = mock.MagicMock()
+    with pytest.raises(RuntimeError) as ex:
+        pm.initialize("COM0")
+    assert ex.value.args[0] == _("Reboot Error")
+    pm.close_serial_link.assert_called_once_with()
+    assert target.reset_last_selected.call_count == 0
+
+
+def test_ESP32PackagesManager_initialize_reset_fail():
+    """
+    If selecting the start up slot fails, the serial link is closed and a
+    "Reset Error" is raised.
+    """
+    target = mock.MagicMock()
+    target.reset_last_selected.side_effect = IOError("boom")
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    pm.open_serial_link = mock.MagicMock()
+    pm.close_serial_link = mock.MagicMock()
+    with pytest.raises(RuntimeError) as ex:
+        pm.initialize("COM0")
+    assert ex.value.args[0] == _("Reset Error")
+    pm.close_serial_link.assert_called_once_with()
+
+
+def test_ESP32PackagesManager_open_serial_link_DTR_unset():
+    """
+    If DTR is unset fall back to pyserial to set it.
+    """
+    pm = mu.interface.dialogs.ESP32PackagesManager(mock.MagicMock())
+    with mock.patch(
+        "mu.interface.dialogs.QSerialPort"
+    ) as mock_serial, mock.patch(
+        "mu.interface.dialogs.Serial"
+    ) as mock_pyserial:
+        port = mock_serial.return_value
+        port.open.return_value = True
+        port.isDataTerminalReady.return_value = False
+        pm.open_serial_link("COM0")
+    mock_pyserial.assert_called_once_with("COM0")
+    assert mock_pyserial.return_value.dtr is True
+    mock_pyserial.return_value.close.assert_called_once_with()
+    assert port.open.call_count == 2
+
+
+def test_ESP32PackagesManager_connect_fail():
+    """
+    If the device fails to connect to the access point ensure the serial
+    link is closed and the failure signal is emitted.
+    """
+    target = mock.MagicMock()
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    pm.open_serial_link = mock.MagicMock()
+    pm.close_serial_link = mock.MagicMock()
+    pm.on_connect = mock.MagicMock()
+    pm.on_connect_fail = mock.MagicMock()
+    with mock.patch(
+        "mu.interface.dialogs.sbfs.send_cmd", side_effect=IOError("boom")
+    ):
+        pm.connect("COM0", True, "ssid", "password")
+    pm.close_serial_link.assert_called_once_with()
+    pm.on_connect_fail.emit.assert_called_once_with(
+        _("Wi-Fi Connect Error"), "boom"
+    )
+    assert pm.on_connect.emit.call_count == 0
+
+
+def test_ESP32PackagesManager_install():
+    """
+    Ensure all the libraries are installed with a single command and the
+    output for each library is reported.
+    """
+    target = mock.MagicMock()
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    pm.open_serial_link = mock.MagicMock()
+    pm.close_serial_link = mock.MagicMock()
+    pm.on_install = mock.MagicMock()
+    out = (
+        b"Installing foo\r\n__OK__\r\n"
+        b"Installing bar\r\nError installing 'bar'\r\n__OK__\r\n"
+        b"__ERR__ boom\r\n"
+    )
+    with mock.patch(
+        "mu.interface.dialogs.sbfs.send_cmd", return_value=(out, b"")
+    ) as mock_send:
+        pm.install("COM0", ["foo", "bar", "baz"])
+    command = mock_send.call_args[0][0]
+    assert len(command) == 1
+    assert command[0].startswith("import upip\n")
+    assert "upip.install('foo')" in command[0]
+    assert "upip.install('baz')" in command[0]
+    pm.on_install.emit.assert_called_once_with(
+        {
+            "foo": "OK\nInstalling foo\n",
+            "bar": "NG\nInstalling bar\nError installing 'bar'\n",
+            "baz": "NG\nboom\n",
+        }
+    )
+    pm.close_serial_link.assert_called_once_with()
+
+
+def test_ESP32PackagesManager_install_stderr():
+    """
+    If the command fails on the device, every library is reported as failed
+    with the error.
+    """
+    target = mock.MagicMock()
+    pm = mu.interface.dialogs.ESP32PackagesManager(target)
+    pm.open_serial_link = mock.MagicMock()
+    pm.close_serial_link = mock.MagicMock()
+    pm.on_install = mock.MagicMock()
+    with mock.patch(
+        "mu.interface.dialogs.sbfs.send_cmd", return_value=(b"", b"Bang")
+    ):
+        pm.install("COM0", ["foo", "bar"])
+    pm.on_install.emit.assert_called_once_with(
+        {"foo": "NG\nBang\n", "bar": "NG\nBang\n"}
+    )
+
+
+def test_ESP32PackagesWidget_scan():
+    """
+    Ensure a scan is handed to the manager's thread and the resulting SSIDs
+    are listed.
+    """
+    target = mock.MagicMock()
+    target.find_device.return_value = ("COM0", "12345")
+    pw = mu.interface.dialogs.ESP32PackagesWidget()
+    pw.setup(target)
+    pw.start_scan = mock.MagicMock()
+    pw.scan()
+    pw.start_scan.emit.assert_called_once_with("COM0")
+    assert not pw.button_scan.isEnabled()
+    assert pw.busy
+    pw.on_scan(["foo", "bar"])
+    assert pw.list_ssid.count() == 2
+    assert pw.list_ssid.completer().model() is pw.list_ssid.model()
+    assert pw.button_scan.isEnabled()
+    assert not pw.busy
+    pw.stop()
+    assert pw.manager_thread.isFinished()
+
+
+def test_ESP32PackagesWidget_no_device():
+    """
+    The device is looked for on the GUI thread, and if there isn't one the
+    user is told and no command is sent to the manager's thread.
+    """
+    target = mock.MagicMock()
+    target.find_device.return_value = (None, None)
+    pw = mu.interface.dialogs.ESP32PackagesWidget()
+    pw.setup(target)
+    pw.start_scan = mock.MagicMock()
+    pw.start_connect = mock.MagicMock()
+    pw.start_install = mock.MagicMock()
+    pw.scan()
+    pw.connect(True)
+    pw.install()
+    assert pw.start_scan.emit.call_count == 0
+    assert pw.start_connect.emit.call_count == 0
+    assert pw.start_install.emit.call_count == 0
+    assert target.view.show_message.call_count == 3
+    assert pw.button_scan.isEnabled()
+    assert not pw.busy
+    pw.stop()
+
+
+def test_ESP32PackagesWidget_install():
+    """
+    The port found on the GUI thread is sent with the libraries to install.
+    """
+    target = mock.MagicMock()
+    target.find_device.return_value = ("COM0", "12345")
+    pw = mu.interface.dialogs.ESP32PackagesWidget()
+    pw.setup(target)
+    pw.start_install = mock.MagicMock()
+    pw.text_area.setPlainText("foo\n\nbar")
+    pw.install()
+    pw.start_install.emit.assert_called_once_with("COM0", ["foo", "bar"])
+    assert pw.busy
+    pw.stop()
+
+
+def test_ESP32PackagesWidget_on_install():
+    """
+    Ensure the result of installing each library is shown to the user.
+    """
+    pw = mu.interface.dialogs.ESP32PackagesWidget()
+    pw.target = mock.MagicMock()
+    pw.text_area = mock.MagicMock()
+    pw.text_area.toPlainText.return_value = "foo\nbar"
+    pw.button_inst = mock.MagicMock()
+    pw.on_install({"foo": "OK\nfoo\n", "bar": "NG\nbar\n"})
+    pw.target.view.show_message.assert_called_once_with(
+        "UPIP Result", "[foo]\nOK\nfoo\n\n[bar]\nNG\nbar\n\n"
+    )
+    pw.button_inst.setEnabled.assert_called_once_with(True)
+
+
+def test_ESP32PackagesWidget_on_install_fail():
+    """
+    If installing fails the user is told why and can try installing again,
+    without the connect button being enabled.
+    """
+    pw = mu.interface.dialogs.ESP32PackagesWidget()
+    pw.setup(mock.MagicMock())
+    pw.groupbox_install.setEnabled(True)  # As it is once connected.
+    pw.text_area.setPlainText("foo")
+    pw.button_inst.setEnabled(False)
+    with mock.patch("mu.interface.dialogs.QMessageBox") as mock_box:
+        pw.on_install_fail("Bang", "boom")
+    assert mock_box.critical.call_count == 1
+    assert pw.button_inst.isEnabled()
+    assert not pw.button_conn.isEnabled()
+    pw.stop()
+
+
 def test_AdminDialog_setup():
     """
     Ensure the admin dialog is setup properly given the content of a log
@@ -160,9 +690,11 @@ def test_AdminDialog_setup():
         "microbit_runtime": "/foo/bar",
     }
     packages = "foo\nbar\nbaz\n"
+    mode = mock.MagicMock()
+    mode.name = "Python 3"
     mock_window = QWidget()
     ad = mu.interface.dialogs.AdminDialog(mock_window)
-    ad.setup(log, settings, packages)
+    ad.setup(log, settings, packages, mode)
     assert ad.log_widget.log_text_area.toPlainText() == log
     s = ad.settings()
     assert s["packages"] == packages
@@ -170,6 +702,73 @@ def test_AdminDialog_setup():
     assert s == settings
 
 
+def test_AdminDialog_setup_tab():
+    """
+    Ensure the widgets in the non-default tabs are only set up when their tab
+    is first shown, and that changes made in them are then reported.
+    """
+    settings = {
+        "envars": "name=value",
+        "minify": True,
+        "microbit_runtime": "/foo/bar",
+    }
+    packages = "foo\nbar\nbaz\n"
+    mode = mock.MagicMock()
+    mode.name = "Python 3"
+    mock_window = QWidget()
+    ad = mu.interface.dialogs.AdminDialog(mock_window)
+    ad.setup("log", settings, packages, mode)
+    assert ad.package_widget in ad.pending_setup
+    assert not hasattr(ad.package_widget, "text_area")
+    ad.tabs.setCurrentWidget(ad.package_widget)
+    assert ad.package_widget not in ad.pending_setup
+    ad.package_widget.text_area.setPlainText("qux")
+    assert ad.settings()["packages"] == "qux"
+
+
+def test_AdminDialog_done_stops_esp32_package_widget():
+    """
+    Ensure the thread used by the MicroPython packages tab is stopped when
+    the dialog is closed, if the tab has been shown.
+    """
+    mode = mock.MagicMock()
+    mode.name = "Artec Studuino:Bit MicroPython"
+    mock_window = QWidget()
+    ad = mu.interface.dialogs.AdminDialog(mock_window)
+    ad.setup("log", {}, "", mode)
+    ad.tabs.setCurrentWidget(ad.esp32_package_widget)
+    assert ad.esp32_package_widget.manager_thread.isRunning()
+    ad.done(QDialog.Rejected)
+    assert ad.esp32_package_widget.manager_thread.isFinished()
+
+
+def test_AdminDialog_done_waits_for_esp32_command():
+    """
+    If a command is still being sent to the device, closing the dialog
+    doesn't block. The dialog says it's waiting and closes, with the result
+    asked for, once the command has finished.
+    """
+    mode = mock.MagicMock()
+    mode.name = "Artec Studuino:Bit MicroPython"
+    mock_window = QWidget()
+    ad = mu.interface.dialogs.AdminDialog(mock_window)
+    ad.setup("log", {}, "", mode)
+    ad.tabs.setCurrentWidget(ad.esp32_package_widget)
+    widget = ad.esp32_package_widget
+    widget.busy = True
+    with mock.patch("mu.interface.dialogs.QDialog.done") as mock_done:
+        ad.done(QDialog.Accepted)
+        ad.done(QDialog.Rejected)  # Asking again makes no difference.
+        assert mock_done.call_count == 0
+        assert not ad.isEnabled()
+        assert widget.manager_thread.isRunning()
+        assert ad.windowTitle() != _("Mu Administration")
+        widget.finish_command()
+        mock_done.assert_called_once_with(QDialog.Accepted)
+    assert widget.manager_thread.isFinished()
+    assert ad.isEnabled()
+
+
 def test_FindReplaceDialog_setup():
     """
     Ensure the find/replace dialog is setup properly given only the theme
@@ -215,13 +814,26 @@ def test_PackageDialog_setup():
     assert pd.pkg_dirs == {}
 
 
+def dir_entry(parent, name, is_dir=True):
+    """
+    Return a mock os.DirEntry for the named entry in the parent directory.
+    """
+    entry = mock.MagicMock()
+    entry.name = name
+    entry.path = os.path.join(parent, name)
+    entry.is_dir.return_value = is_dir
+    entry.is_file.return_value = not is_dir
+    entry.is_symlink.return_value = False
+    return entry
+
+
 def test_PackageDialog_remove_packages():
     """
     Ensure the pkg_dirs of to-be-removed packages is correctly filled and the
-    remove_package method is scheduled.
+    removal is started in a new thread.
     """
     pd = mu.interface.dialogs.PackageDialog()
-    pd.to_remove = {"foo", "bar-baz", "Quux"}
+    pd.to_remove = {"foo", "bar-baz", "Quux", "Spam", "missing"}
     pd.module_dir = "wibble"
     dirs = [
         "foo-1.0.0.dist-info",
@@ -230,120 +842,268 @@ def test_PackageDialog_remove_packages():
         "bar_baz",
         "quux-1.0.0.dist-info",
         "quux",
+        "spam-2.0-py3.7.egg-info",
+        "spam_eggs-1.0.dist-info",
+    ]
+    mock_scandir = mock.MagicMock()
+    mock_scandir.return_value.__enter__.return_value = [
+        dir_entry("wibble", d) for d in dirs
     ]
     with mock.patch(
-        "mu.interface.dialogs.os.listdir", return_value=dirs
-    ), mock.patch("mu.interface.dialogs.QTimer") as mock_qtimer:
+        "mu.interface.dialogs.os.scandir", mock_scandir
+    ), mock.patch("mu.interface.dialogs.QThread") as mock_qthread, mock.patch(
+        "mu.interface.dialogs.PackageRemover"
+    ) as mock_remover:
         pd.remove_packages()
         assert pd.pkg_dirs == {
             "foo": os.path.join("wibble", "foo-1.0.0.dist-info"),
             "bar-baz": os.path.join("wibble", "bar_baz-1.0.0.dist-info"),
             "Quux": os.path.join("wibble", "quux-1.0.0.dist-info"),
+            "Spam": os.path.join("wibble", "spam-2.0-py3.7.egg-info"),
         }
-        mock_qtimer.singleShot.assert_called_once_with(2, pd.remove_package)
+        mock_remover.assert_called_once_with("wibble", pd.pkg_dirs)
+        remover = mock_remover.return_value
+        remover.moveToThread.assert_called_once_with(pd.remove_thread)
+        pd.remove_thread.started.connect.assert_called_once_with(
+            remover.remove_packages
+        )
+        remover.on_remove.connect.assert_called_once_with(pd.append_data)
+        remover.on_finished.connect.assert_called_once_with(
+            pd.on_remove_finished
+        )
+        mock_qthread.return_value.start.assert_called_once_with()
 
 
-def test_PackageDialog_remove_package_dist_info():
+def test_PackageDialog_remove_packages_none_found():
     """
-    Ensures that if there are packages remaining to be deleted, then the next
-    one is deleted as expected.
+    If none of the packages to be removed are installed, no thread is started.
     """
     pd = mu.interface.dialogs.PackageDialog()
-    pd.append_data = mock.MagicMock()
-    pd.pkg_dirs = {"foo": os.path.join("bar", "foo-1.0.0.dist-info")}
-    pd.module_dir = "baz"
-    files = [["filename1", ""], ["filename2", ""], ["filename3", ""]]
+    pd.to_remove = {"foo"}
+    pd.module_dir = "wibble"
+    mock_scandir = mock.MagicMock()
+    mock_scandir.return_value.__enter__.return_value = []
+    with mock.patch(
+        "mu.interface.dialogs.os.scandir", mock_scandir
+    ), mock.patch("mu.interface.dialogs.QThread") as mock_qthread:
+        pd.remove_packages()
+    assert pd.pkg_dirs == {}
+    assert mock_qthread.call_count == 0
+    assert pd.remove_thread is None
+
+
+def test_PackageRemover_remove_packages():
+    """
+    Ensure each package is removed in turn, then the module directory is
+    cleaned up and the finished signal is emitted.
+    """
+    pkg_dirs = {
+        "foo": os.path.join("bar", "foo-1.0.0.dist-info"),
+        "baz": os.path.join("bar", "baz-1.0.0.dist-info"),
+    }
+    pr = mu.interface.dialogs.PackageRemover("bar", pkg_dirs)
+    pr.remove_package = mock.MagicMock()
+    pr.clean_module_dir = mock.MagicMock()
+    pr.on_finished = mock.MagicMock()
+    pr.remove_packages()
+    assert pr.remove_package.call_args_list == [
+        mock.call("foo", os.path.join("bar", "foo-1.0.0.dist-info")),
+        mock.call("baz", os.path.join("bar", "baz-1.0.0.dist-info")),
+    ]
+    pr.clean_module_dir.assert_called_once_with()
+    pr.on_finished.emit.assert_called_once_with()
+
+
+def test_PackageRemover_remove_package_dist_info():
+    """
+    Ensures that a package is deleted as expected.
+    """
+    info = os.path.join("bar", "foo-1.0.0.dist-info")
+    pr = mu.interface.dialogs.PackageRemover("baz", {"foo": info})
+    pr.on_remove = mock.MagicMock()
+    files = "".join(
+        [
+            "filename1,sha256=abc,10\r\n",
+            "foo/__init__.py,sha256=abc,10\r\n",
+            "foo/bar.py,sha256=abc,10\r\n",
+            "foo-1.0.0.dist-info/RECORD,,\r\n",
+            "__pycache__/filename1.pyc,,\r\n",
+            "../../bin/foo,sha256=abc,10\r\n",
+            '"gone/a,b.py",sha256=abc,10\r\n',
+            "\r\n",
+        ]
+    )
     mock_remove = mock.MagicMock()
     mock_shutil = mock.MagicMock()
-    mock_qtimer = mock.MagicMock()
-    with mock.patch("builtins.open"), mock.patch(
-        "mu.interface.dialogs.csv.reader", return_value=files
-    ), mock.patch("mu.interface.dialogs.os.remove", mock_remove), mock.patch(
+    pr.remove_bytecode = mock.MagicMock()
+    pr.remove_empty_dirs = mock.MagicMock()
+    with mock.patch(
+        "builtins.open", mock.mock_open(read_data=files)
+    ), mock.patch("mu.interface.dialogs.os.unlink", mock_remove), mock.patch(
         "mu.interface.dialogs.shutil", mock_shutil
-    ), mock.patch(
-        "mu.interface.dialogs.QTimer", mock_qtimer
     ):
-        pd.remove_package()
-        assert pd.pkg_dirs == {}
-        assert mock_remove.call_count == 3
-        assert mock_shutil.rmtree.call_count == 3
-        pd.append_data.assert_called_once_with("Removed foo\n")
-        mock_qtimer.singleShot.assert_called_once_with(2, pd.remove_package)
+        pr.remove_package("foo", info)
+        assert mock_remove.call_count == 7
+        assert mock_remove.call_args_list[1] == mock.call(
+            os.path.join("baz", "foo", "__init__.py")
+        )
+        assert mock_remove.call_args_list[6] == mock.call(
+            os.path.join("baz", "gone", "a,b.py")
+        )
+        mock_shutil.rmtree.assert_called_once_with(
+            os.path.join("bar", "foo-1.0.0.dist-info"), ignore_errors=True
+        )
+        foo_dir = os.path.join("baz", "foo")
+        assert mock.call(foo_dir, {"__init__", "bar"}) in (
+            pr.remove_bytecode.call_args_list
+        )
+        assert mock.call(os.path.join("baz", "gone"), {"a,b"}) in (
+            pr.remove_bytecode.call_args_list
+        )
+        empty_dirs = [c[0][0] for c in pr.remove_empty_dirs.call_args_list]
+        assert foo_dir in empty_dirs
+        assert "baz" in empty_dirs
+        # Deeper directories are tried before the ones containing them.
+        assert empty_dirs.index(foo_dir) < empty_dirs.index("baz")
+        pr.on_remove.emit.assert_called_once_with("Removed foo\n")
 
 
-def test_PackageDialog_remove_package_dist_info_cannot_delete():
+def test_PackageRemover_remove_package_dist_info_shared_dir():
     """
-    Ensures that if there are packages remaining to be deleted, then the next
-    one is deleted and any failures are logged.
+    Removing a package leaves the files other packages installed in the same
+    top level directory (e.g. a namespace package) in place.
     """
-    pd = mu.interface.dialogs.PackageDialog()
-    pd.append_data = mock.MagicMock()
-    pd.pkg_dirs = {"foo": os.path.join("bar", "foo-1.0.0.dist-info")}
-    pd.module_dir = "baz"
-    files = [["filename1", ""], ["filename2", ""], ["filename3", ""]]
+    with tempfile.TemporaryDirectory() as module_dir:
+        installed = {
+            "foo": ["google/foo/__init__.py", "google/foo/api.py"],
+            "bar": ["google/bar/__init__.py"],
+        }
+        infos = {}
+        for package, paths in installed.items():
+            info = os.path.join(module_dir, package + "-1.0.dist-info")
+            os.makedirs(info)
+            record = [p + ",sha256=abc,10\n" for p in paths]
+            record.append(package + "-1.0.dist-info/RECORD,,\n")
+            with open(os.path.join(info, "RECORD"), "w") as f:
+                f.writelines(record)
+            for path in paths:
+                path = os.path.join(module_dir, *path.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, "w").close()
+                pycache = os.path.join(os.path.dirname(path), "__pycache__")
+                os.makedirs(pycache, exist_ok=True)
+                name = os.path.splitext(os.path.basename(path))[0]
+                pyc = os.path.join(pycache, name + ".cpython-38.pyc")
+                open(pyc, "w").close()
+            infos[package] = info
+        pr = mu.interface.dialogs.PackageRemover(module_dir, {})
+        pr.on_remove = mock.MagicMock()
+        pr.remove_package("foo", infos["foo"])
+        google = os.path.join(module_dir, "google")
+        assert os.listdir(google) == ["bar"]
+        assert sorted(os.listdir(os.path.join(google, "bar"))) == [
+            "__init__.py",
+            "__pycache__",
+        ]
+        assert not os.path.exists(infos["foo"])
+        assert os.path.exists(infos["bar"])
+        pr.remove_package("bar", infos["bar"])
+        assert os.listdir(module_dir) == []
+
+
+def test_PackageRemover_remove_bytecode():
+    """
+    Only the compiled files of the named modules are removed, along with the
+    cache directory once it's empty.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        pycache = os.path.join(directory, "__pycache__")
+        os.mkdir(pycache)
+        for filename in ("foo.cpython-38.pyc", "foobar.cpython-38.pyc"):
+            open(os.path.join(pycache, filename), "w").close()
+        pr = mu.interface.dialogs.PackageRemover(directory, {})
+        pr.remove_bytecode(directory, {"foo"})
+        assert os.listdir(pycache) == ["foobar.cpython-38.pyc"]
+        pr.remove_bytecode(directory, {"foobar"})
+        assert not os.path.exists(pycache)
+        # Nothing happens if there's no cache directory.
+        pr.remove_bytecode(directory, {"foobar"})
+
+
+def test_PackageRemover_remove_empty_dirs():
+    """
+    Empty directories are removed up to, but not including, the module
+    directory and a directory that still has something in it stops the walk.
+    """
+    with tempfile.TemporaryDirectory() as module_dir:
+        deepest = os.path.join(module_dir, "a", "b", "c")
+        os.makedirs(deepest)
+        open(os.path.join(module_dir, "a", "keep.py"), "w").close()
+        pr = mu.interface.dialogs.PackageRemover(module_dir, {})
+        pr.remove_empty_dirs(os.path.join(deepest, "gone"))
+        assert os.listdir(os.path.join(module_dir, "a")) == ["keep.py"]
+        os.remove(os.path.join(module_dir, "a", "keep.py"))
+        pr.remove_empty_dirs(os.path.join(module_dir, "a"))
+        assert os.listdir(module_dir) == []
+        assert os.path.isdir(module_dir)
+
+
+def test_PackageRemover_remove_package_dist_info_cannot_delete():
+    """
+    Ensures that a package is deleted and any failures are logged.
+    """
+    info = os.path.join("bar", "foo-1.0.0.dist-info")
+    pr = mu.interface.dialogs.PackageRemover("baz", {"foo": info})
+    pr.on_remove = mock.MagicMock()
+    files = "filename1,,\nfilename2,,\nfilename3,,\n"
     mock_remove = mock.MagicMock(side_effect=Exception("Bang"))
     mock_shutil = mock.MagicMock()
-    mock_qtimer = mock.MagicMock()
     mock_log = mock.MagicMock()
-    with mock.patch("builtins.open"), mock.patch(
-        "mu.interface.dialogs.csv.reader", return_value=files
-    ), mock.patch("mu.interface.dialogs.os.remove", mock_remove), mock.patch(
+    with mock.patch(
+        "builtins.open", mock.mock_open(read_data=files)
+    ), mock.patch("mu.interface.dialogs.os.unlink", mock_remove), mock.patch(
         "mu.interface.dialogs.logger.error", mock_log
     ), mock.patch(
         "mu.interface.dialogs.shutil", mock_shutil
-    ), mock.patch(
-        "mu.interface.dialogs.QTimer", mock_qtimer
     ):
-        pd.remove_package()
-        assert pd.pkg_dirs == {}
+        pr.remove_package("foo", info)
         assert mock_remove.call_count == 3
         assert mock_log.call_count == 6
-        assert mock_shutil.rmtree.call_count == 3
-        pd.append_data.assert_called_once_with("Removed foo\n")
-        mock_qtimer.singleShot.assert_called_once_with(2, pd.remove_package)
+        assert mock_shutil.rmtree.call_count == 1
+        pr.on_remove.emit.assert_called_once_with("Removed foo\n")
 
 
-def test_PackageDialog_remove_package_egg_info():
+def test_PackageRemover_remove_package_egg_info():
     """
-    Ensures that if there are packages remaining to be deleted, then the next
-    one is deleted as expected.
+    Ensures that a package is deleted as expected.
     """
-    pd = mu.interface.dialogs.PackageDialog()
-    pd.append_data = mock.MagicMock()
-    pd.pkg_dirs = {"foo": os.path.join("bar", "foo-1.0.0.egg-info")}
-    pd.module_dir = "baz"
+    info = os.path.join("bar", "foo-1.0.0.egg-info")
+    pr = mu.interface.dialogs.PackageRemover("baz", {"foo": info})
+    pr.on_remove = mock.MagicMock()
     files = "".join(["filename1\n", "filename2\n", "filename3\n"])
     mock_remove = mock.MagicMock()
     mock_shutil = mock.MagicMock()
-    mock_qtimer = mock.MagicMock()
     with mock.patch(
         "builtins.open", mock.mock_open(read_data=files)
     ), mock.patch("mu.interface.dialogs.os.remove", mock_remove), mock.patch(
         "mu.interface.dialogs.shutil", mock_shutil
-    ), mock.patch(
-        "mu.interface.dialogs.QTimer", mock_qtimer
     ):
-        pd.remove_package()
-        assert pd.pkg_dirs == {}
+        pr.remove_package("foo", info)
         assert mock_remove.call_count == 3
         assert mock_shutil.rmtree.call_count == 3
-        pd.append_data.assert_called_once_with("Removed foo\n")
-        mock_qtimer.singleShot.assert_called_once_with(2, pd.remove_package)
+        pr.on_remove.emit.assert_called_once_with("Removed foo\n")
 
 
-def test_PackageDialog_remove_package_egg_info_cannot_delete():
+def test_PackageRemover_remove_package_egg_info_cannot_delete():
     """
-    Ensures that if there are packages remaining to be deleted, then the next
-    one is deleted and any failures are logged.
+    Ensures that a package is deleted and any failures are logged.
     """
-    pd = mu.interface.dialogs.PackageDialog()
-    pd.append_data = mock.MagicMock()
-    pd.pkg_dirs = {"foo": os.path.join("bar", "foo-1.0.0.egg-info")}
-    pd.module_dir = "baz"
+    info = os.path.join("bar", "foo-1.0.0.egg-info")
+    pr = mu.interface.dialogs.PackageRemover("baz", {"foo": info})
+    pr.on_remove = mock.MagicMock()
     files = "".join(["filename1\n", "filename2\n", "filename3\n"])
     mock_remove = mock.MagicMock(side_effect=Exception("Bang"))
     mock_shutil = mock.MagicMock()
-    mock_qtimer = mock.MagicMock()
     mock_log = mock.MagicMock()
     with mock.patch(
         "builtins.open", mock.mock_open(read_data=files)
@@ -351,86 +1111,140 @@ def test_PackageDialog_remove_package_egg_info_cannot_delete():
         "mu.interface.dialogs.logger.error", mock_log
     ), mock.patch(
         "mu.interface.dialogs.shutil", mock_shutil
-    ), mock.patch(
-        "mu.interface.dialogs.QTimer", mock_qtimer
     ):
-        pd.remove_package()
-        assert pd.pkg_dirs == {}
+        pr.remove_package("foo", info)
         assert mock_remove.call_count == 3
         assert mock_log.call_count == 6
         assert mock_shutil.rmtree.call_count == 3
-        pd.append_data.assert_called_once_with("Removed foo\n")
-        mock_qtimer.singleShot.assert_called_once_with(2, pd.remove_package)
+        pr.on_remove.emit.assert_called_once_with("Removed foo\n")
 
 
-def test_PackageDialog_remove_package_egg_info_cannot_open_record():
+def test_PackageRemover_remove_package_egg_info_cannot_open_record():
     """
     If the installed-files.txt file is not available (sometimes the case), then
     simply raise an exception and communicate this to the user.
     """
-    pd = mu.interface.dialogs.PackageDialog()
-    pd.append_data = mock.MagicMock()
-    pd.pkg_dirs = {"foo": os.path.join("bar", "foo-1.0.0.egg-info")}
-    pd.module_dir = "baz"
-    mock_qtimer = mock.MagicMock()
+    info = os.path.join("bar", "foo-1.0.0.egg-info")
+    pr = mu.interface.dialogs.PackageRemover("baz", {"foo": info})
+    pr.on_remove = mock.MagicMock()
     mock_log = mock.MagicMock()
     with mock.patch(
         "builtins.open", mock.MagicMock(side_effect=Exception("boom"))
-    ), mock.patch("mu.interface.dialogs.logger.error", mock_log), mock.patch(
-        "mu.interface.dialogs.QTimer", mock_qtimer
-    ):
-        pd.remove_package()
-        assert pd.pkg_dirs == {}
+    ), mock.patch("mu.interface.dialogs.logger.error", mock_log):
+        pr.remove_package("foo", info)
         assert mock_log.call_count == 2
         msg = (
             "UNABLE TO REMOVE PACKAGE: foo (check the logs for "
-            "more information.)"
+            "more information.)\n"
         )
-        pd.append_data.assert_called_once_with(msg)
-        mock_qtimer.singleShot.assert_called_once_with(2, pd.remove_package)
+        pr.on_remove.emit.assert_called_once_with(msg)
 
 
-def test_PackageDialog_remove_package_end_state():
+def test_PackageRemover_clean_module_dir():
     """
-    If there are no more packages to remove and there's nothing to be done for
-    adding packages, then ensure all directories that do not contain files are
-    deleted and the expected end-state is called.
+    Ensure all directories that do not contain files are deleted.
     """
-    pd = mu.interface.dialogs.PackageDialog()
-    pd.module_dir = "foo"
-    pd.pkg_dirs = {}
-    pd.to_add = {}
-    pd.process = None
-    pd.end_state = mock.MagicMock()
+    pr = mu.interface.dialogs.PackageRemover("foo", {})
+    mock_scandir = mock.MagicMock()
+    mock_scandir.return_value.__enter__.return_value = [
+        dir_entry("foo", "bar"),
+        dir_entry("foo", "baz"),
+        dir_entry("foo", "qux", is_dir=False),
+    ]
     with mock.patch(
-        "mu.interface.dialogs.os.listdir", return_value=["bar", "baz"]
+        "mu.interface.dialogs.os.scandir", mock_scandir
     ), mock.patch(
-        "mu.interface.dialogs.os.walk",
-        side_effect=[[("bar", [], [])], [("baz", [], ["x"])]],
+        "mu.interface.dialogs.has_files", side_effect=[False, True]
     ), mock.patch(
         "mu.interface.dialogs.shutil"
     ) as mock_shutil:
-        pd.remove_package()
-        assert mock_shutil.rmtree.call_count == 2
-        call_args = mock_shutil.rmtree.call_args_list
-        assert call_args[0][0][0] == os.path.join("foo", "bar")
-        assert call_args[1][0][0] == os.path.join("foo", "bin")
+        pr.clean_module_dir()
+        mock_shutil.rmtree.assert_called_once_with(
+            os.path.join("foo", "bar"), ignore_errors=True
+        )
+
+
+def test_PackageDialog_on_remove_finished_end_state():
+    """
+    If there's nothing to be done for adding packages once the removal is
+    finished, then the thread is stopped and the expected end-state is called.
+    """
+    pd = mu.interface.dialogs.PackageDialog()
+    pd.remove_thread = mock.MagicMock()
+    pd.pkg_dirs = {"foo": "bar"}
+    pd.to_add = set()
+    pd.process = None
+    pd.end_state = mock.MagicMock()
+    pd.on_remove_finished()
+    pd.remove_thread.quit.assert_called_once_with()
+    assert pd.pkg_dirs == {}
     pd.end_state.assert_called_once_with()
 
 
+def test_PackageDialog_on_remove_finished_pip_running():
+    """
+    If pip is still installing packages once the removal is finished, leave
+    the end state to pip.
+    """
+    pd = mu.interface.dialogs.PackageDialog()
+    pd.remove_thread = mock.MagicMock()
+    pd.pkg_dirs = {"foo": "bar"}
+    pd.to_add = set()
+    pd.process = mock.MagicMock()
+    pd.end_state = mock.MagicMock()
+    pd.on_remove_finished()
+    assert pd.pkg_dirs == {}
+    assert pd.end_state.call_count == 0
+
+
+def test_PackageDialog_done_waits_for_removal():
+    """
+    Ensure closing the dialog waits for any package removal to finish.
+    """
+    pd = mu.interface.dialogs.PackageDialog()
+    pd.remove_thread = mock.MagicMock()
+    with mock.patch("mu.interface.dialogs.QDialog.done") as mock_done:
+        pd.done(1)
+    pd.remove_thread.quit.assert_called_once_with()
+    pd.remove_thread.wait.assert_called_once_with()
+    mock_done.assert_called_once_with(1)
+
+
 def test_PackageDialog_end_state():
     """
     Ensure the expected end-state is correctly cofigured (for when all tasks
     relating to third party packages have finished).
     """
     pd = mu.interface.dialogs.PackageDialog()
+    pd.module_dir = "foo"
     pd.append_data = mock.MagicMock()
     pd.button_box = mock.MagicMock()
-    pd.end_state()
-    pd.append_data.assert_called_once_with("\nFINISHED")
+    with mock.patch(
+        "mu.interface.dialogs.os.path.isdir", return_value=True
+    ), mock.patch("mu.interface.dialogs.shutil") as mock_shutil:
+        pd.end_state()
+    mock_shutil.rmtree.assert_called_once_with(
+        os.path.join("foo", "bin"), ignore_errors=True
+    )
+    pd.append_data.assert_called_once_with("\nFINISHED\n")
     pd.button_box.button().setEnabled.assert_called_once_with(True)
 
 
+def test_PackageDialog_end_state_no_bin():
+    """
+    If pip didn't create a bin directory, there's nothing to remove.
+    """
+    pd = mu.interface.dialogs.PackageDialog()
+    pd.module_dir = "foo"
+    pd.append_data = mock.MagicMock()
+    pd.button_box = mock.MagicMock()
+    with mock.patch(
+        "mu.interface.dialogs.os.path.isdir", return_value=False
+    ), mock.patch("mu.interface.dialogs.shutil") as mock_shutil:
+        pd.end_state()
+    assert mock_shutil.rmtree.call_count == 0
+
+
 def test_PackageDialog_run_pip():
     """
     Ensure the expected package to be installed is done so via the expected
@@ -438,8 +1252,9 @@ def test_PackageDialog_run_pip():
     us "pip").
     """
     pd = mu.interface.dialogs.PackageDialog()
-    pd.to_add = {"foo"}
+    pd.to_add = {"foo", "baz"}
     pd.module_dir = "bar"
+    pd.append_data = mock.MagicMock()
     mock_process = mock.MagicMock()
     with mock.patch("mu.interface.dialogs.QProcess", mock_process):
         pd.run_pip()
@@ -450,25 +1265,27 @@ def test_PackageDialog_run_pip():
             "-m",  # run the module
             "pip",  # called pip
             "install",  # to install
-            "foo",  # a package called "foo"
+            "--progress-bar",  # without...
+            "off",  # ...a progress bar
+            "baz",  # a package called "baz"
+            "foo",  # and a package called "foo"
             "--target",  # and the target directory for package assets is...
             "bar",  # ...this directory
         ]
         pd.process.start.assert_called_once_with(sys.executable, args)
+    pd.append_data.assert_called_once_with("Installing: baz, foo\n")
 
 
 def test_PackageDialog_finished_with_more_to_remove():
     """
-    When the pip process is finished, check if there are more packages to
-    install and run again.
+    When the pip process is finished but packages are still being removed,
+    leave the end state to the removal.
     """
     pd = mu.interface.dialogs.PackageDialog()
-    pd.to_add = {"foo"}
-    pd.run_pip = mock.MagicMock()
-    pd.process = mock.MagicMock()
+    pd.pkg_dirs = {"foo": "bar"}
+    pd.end_state = mock.MagicMock()
     pd.finished()
-    assert pd.process is None
-    pd.run_pip.assert_called_once_with()
+    assert pd.end_state.call_count == 0
 
 
 def test_PackageDialog_finished_to_end_state():
@@ -491,23 +1308,64 @@ def test_PackageDialog_read_process():
     """
     pd = mu.interface.dialogs.PackageDialog()
     pd.process = mock.MagicMock()
-    pd.process.readAll().data.return_value = b"hello"
+    pd.process.bytesAvailable.side_effect = [5, 0]
+    pd.process.readAll.return_value = b"hello"
     pd.append_data = mock.MagicMock()
-    mock_timer = mock.MagicMock()
-    with mock.patch("mu.interface.dialogs.QTimer", mock_timer):
-        pd.read_process()
-        pd.append_data.assert_called_once_with("hello")
-        mock_timer.singleShot.assert_called_once_with(2, pd.read_process)
+    pd.read_process()
+    pd.append_data.assert_called_once_with("hello")
+
+
+def test_PackageDialog_read_process_split_character():
+    """
+    Ensure a multi-byte character split across reads is decoded once all of
+    it has arrived, and any incomplete remainder is flushed when pip finishes.
+    """
+    pd = mu.interface.dialogs.PackageDialog()
+    pd.pkg_dirs = {}
+    pd.end_state = mock.MagicMock()
+    pd.process = mock.MagicMock()
+    pd.process.bytesAvailable.side_effect = [4, 0, 3, 0]
+    pd.process.readAll.side_effect = [b"a\xe2\x82", b"\xacb\xe2"]
+    pd.append_data = mock.MagicMock()
+    pd.read_process()
+    pd.append_data.assert_called_once_with("a")
+    pd.read_process()
+    pd.append_data.assert_called_with("\u20acb")
+    pd.finished()
+    pd.append_data.assert_called_with("\ufffd")
+    pd.end_state.assert_called_once_with()
 
 
 def test_PackageDialog_append_data():
     """
-    Ensure that when data is appended, it's added to the end of the text area!
+    Ensure that when data is appended, it's added to the end of the text area
+    once the pending data is flushed.
+    """
+    pd = mu.interface.dialogs.PackageDialog()
+    pd.text_area = mock.MagicMock()
+    with mock.patch("mu.interface.dialogs.QTimer") as mock_timer:
+        pd.append_data("hello\n")
+        pd.append_data("world\n")
+    mock_timer.singleShot.assert_called_once_with(16, pd.flush_data)
+    assert pd.text_area.appendPlainText.call_count == 0
+    pd.flush_data()
+    pd.text_area.appendPlainText.assert_called_once_with("hello\nworld")
+    assert pd.pending_data == []
+    assert pd.partial_line == ""
+
+
+def test_PackageDialog_flush_data_partial_line():
+    """
+    Ensure an incomplete line is held back until the rest of it arrives, so
+    output split across reads isn't broken onto separate lines.
     """
     pd = mu.interface.dialogs.PackageDialog()
     pd.text_area = mock.MagicMock()
-    pd.append_data("hello")
-    c = pd.text_area.textCursor()
-    assert c.movePosition.call_count == 2
-    c.insertText.assert_called_once_with("hello")
-    pd.text_area.setTextCursor.assert_called_once_with(c)
+    pd.pending_data = ["hel"]
+    pd.flush_data()
+    assert pd.text_area.appendPlainText.call_count == 0
+    assert pd.partial_line == "hel"
+    pd.pending_data = ["lo\nwor"]
+    pd.flush_data()
+    pd.text_area.appendPlainText.assert_called_once_with("hello")
+    assert pd.partial_line == "wor"
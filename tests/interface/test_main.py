@@ -2,9 +2,16 @@
 """
 Tests for the user interface elements of Mu.
 """
-from PyQt5.QtWidgets import QAction, QWidget, QFileDialog, QMessageBox
+from PyQt5.QtWidgets import (
+    QAction,
+    QApplication,
+    QWidget,
+    QFileDialog,
+    QMessageBox,
+)
 from PyQt5.QtCore import Qt, QSize, QIODevice
 from PyQt5.QtGui import QIcon, QKeySequence
+from PyQt5.QtSerialPort import QSerialPort
 from unittest import mock
 from mu import __version__
 from tests.test_app import DumSig
@@ -734,6 +741,43 @@ def test_Window_on_serial_read():
     w.data_received.emit.assert_called_once_with(b"Hello")
 
 
+def test_Window_on_serial_error():
+    """
+    When the device goes away the serial_disconnected signal is emitted, but
+    not for other errors.
+    """
+    w = mu.interface.main.Window()
+    w.serial_disconnected = mock.MagicMock()
+    with mock.patch("mu.interface.main.QTimer") as mock_timer:
+        w.on_serial_error(QSerialPort.TimeoutError)
+        assert mock_timer.singleShot.call_count == 0
+        w.on_serial_error(QSerialPort.ResourceError)
+    mock_timer.singleShot.assert_called_once_with(
+        0, w.serial_disconnected.emit
+    )
+
+
+def test_Window_on_serial_error_not_reentrant():
+    """
+    The serial_disconnected handlers aren't called from inside the error
+    signal of the port they close, but once back in the event loop.
+    """
+    w = mu.interface.main.Window()
+    calls = []
+    in_error = []
+    w.serial_disconnected.connect(lambda: calls.append(bool(in_error)))
+
+    def on_error(error):
+        in_error.append(error)
+        w.on_serial_error(error)
+        in_error.pop()
+
+    on_error(QSerialPort.ResourceError)
+    assert calls == []
+    QApplication.processEvents()
+    assert calls == [False]
+
+
 def test_Window_on_stdout_write():
     """
     Ensure the data_received signal is emitted with the data.
@@ -763,6 +807,9 @@ def test_Window_open_serial_link():
     mock_serial.setBaudRate.assert_called_once_with(115200)
     mock_serial.open.assert_called_once_with(QIODevice.ReadWrite)
     mock_serial.readyRead.connect.assert_called_once_with(w.on_serial_read)
+    mock_serial.errorOccurred.connect.assert_called_once_with(
+        w.on_serial_error
+    )
 
 
 def test_Window_open_serial_link_unable_to_connect():
@@ -811,6 +858,7 @@ def test_Window_close_serial_link():
     w.serial = mock_serial
     w.close_serial_link()
     mock_serial.close.assert_called_once_with()
+    mock_serial.deleteLater.assert_called_once_with()
     assert w.serial is None
 
 
@@ -10,10 +10,24 @@ from mu.modes.base import (
     MicroPythonMode,
     FileManager,
     StuduinoBitFileManager,
+    get_default_workspace,
+    get_module_names,
+    get_available_ports,
+    clear_available_ports,
 )
 from unittest import mock
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """
+    Make sure each test reads the settings file and serial ports it has set
+    up.
+    """
+    get_default_workspace.cache_clear()
+    clear_available_ports()
+
+
 def test_base_mode():
     """
     Sanity check for the parent class of all modes.
@@ -34,6 +48,22 @@ def test_base_mode():
     assert bm.builtins is None
 
 
+def test_base_mode_module_names():
+    """
+    The module names are only looked up once, when first needed.
+    """
+    get_module_names.cache_clear()
+    mock_modules = [(None, "foo", False), (None, "bar", True)]
+    with mock.patch(
+        "mu.modes.base.pkgutil.iter_modules", return_value=mock_modules
+    ) as mock_iter:
+        bm = BaseMode(mock.MagicMock(), mock.MagicMock())
+        assert bm.module_names == {"foo", "bar", "sys", "builtins"}
+        assert bm.module_names == {"foo", "bar", "sys", "builtins"}
+        assert mock_iter.call_count == 1
+    get_module_names.cache_clear()
+
+
 def test_base_mode_workspace_dir():
     """
     Return settings file workspace value.
@@ -48,6 +78,36 @@ def test_base_mode_workspace_dir():
         assert bm.workspace_dir() == "/home/foo/mycode"
 
 
+def test_base_mode_workspace_dir_cached():
+    """
+    The settings file is only read the first time the workspace is needed.
+    """
+    with mock.patch(
+        "mu.modes.base.get_settings_path", return_value="tests/settings.json"
+    ), mock.patch("os.path.isdir", return_value=True), mock.patch(
+        "builtins.open", wraps=open
+    ) as mock_open:
+        bm = BaseMode(mock.MagicMock(), mock.MagicMock())
+        assert bm.workspace_dir() == "/home/foo/mycode"
+        assert bm.workspace_dir() == "/home/foo/mycode"
+        assert mock_open.call_count == 1
+
+
+def test_base_mode_workspace_dir_reads_file_once():
+    """
+    The settings file is read in one go and then parsed.
+    """
+    mock_open = mock.mock_open(read_data='{"workspace": "/home/foo/mycode"}')
+    with mock.patch(
+        "mu.modes.base.get_settings_path", return_value="a.json"
+    ), mock.patch("builtins.open", mock_open), mock.patch(
+        "mu.modes.base.json_loads", return_value={}
+    ) as mock_loads:
+        bm = BaseMode(mock.MagicMock(), mock.MagicMock())
+        bm.workspace_dir()
+    mock_loads.assert_called_once_with('{"workspace": "/home/foo/mycode"}')
+
+
 def test_base_mode_workspace_not_present():
     """
     No workspace key in settings file, return default folder.
@@ -165,18 +225,15 @@ def test_base_mode_remove_plotter():
     mock_csv_writer = mock.MagicMock()
     mock_csv = mock.MagicMock()
     mock_csv.writer.return_value = mock_csv_writer
-    with mock.patch(
-        "mu.modes.base.os.path.exists", return_value=False
-    ), mock.patch("mu.modes.base.os.makedirs", mock_mkdir), mock.patch(
+    with mock.patch("mu.modes.base.os.makedirs", mock_mkdir), mock.patch(
         "builtins.open", mock_open
-    ), mock.patch(
-        "mu.modes.base.csv", mock_csv
-    ):
+    ), mock.patch("mu.modes.base.csv", mock_csv):
         bm.remove_plotter()
     assert bm.plotter is None
     view.remove_plotter.assert_called_once_with()
     dd = os.path.join(bm.workspace_dir(), "data_capture")
-    mock_mkdir.assert_called_once_with(dd)
+    mock_mkdir.assert_called_once_with(dd, exist_ok=True)
+    assert mock_open.call_args[1] == {"newline": "", "buffering": 1 << 20}
     mock_csv_writer.writerows.assert_called_once_with(
         view.plotter_pane.raw_data
     )
@@ -225,6 +282,7 @@ def test_micropython_mode_find_device():
         mock_port.serialNumber = mock.MagicMock(return_value="12345")
         mock_os = mock.MagicMock()
         mock_os.name = "nt"
+        clear_available_ports()
         with mock.patch(
             "mu.modes.base.QSerialPortInfo.availablePorts",
             return_value=[mock_port],
@@ -232,6 +290,44 @@ def test_micropython_mode_find_device():
             assert mm.find_device() == ("COM0", "12345")
 
 
+def test_get_available_ports_cached():
+    """
+    A scan of the serial ports is reused until it is PORT_SCAN_TTL seconds
+    old.
+    """
+    mock_port = mock.MagicMock()
+    mock_port.vendorIdentifier.return_value = 0x1
+    mock_port.productIdentifier.return_value = 0x2
+    mock_port.portName.return_value = "COM0"
+    mock_port.serialNumber.return_value = "12345"
+    with mock.patch(
+        "mu.modes.base.QSerialPortInfo.availablePorts",
+        return_value=[mock_port],
+    ) as mock_ports, mock.patch(
+        "mu.modes.base.time.monotonic", side_effect=[10.0, 10.1, 11.0]
+    ):
+        expected = ((0x1, 0x2, "COM0", "12345"),)
+        assert get_available_ports() == expected
+        assert get_available_ports() == expected
+        assert mock_ports.call_count == 1
+        assert get_available_ports() == expected
+        assert mock_ports.call_count == 2
+
+
+def test_micropython_mode_find_device_any_product():
+    """
+    A board ID without a PID matches any product from that vendor.
+    """
+    mm = MicroPythonMode(mock.MagicMock(), mock.MagicMock())
+    mm.board_ids = set()
+    mm.board_vids = {0x1234}
+    ports = ((0x1234, 0x9999, "COM1", "54321"),)
+    with mock.patch(
+        "mu.modes.base.get_available_ports", return_value=ports
+    ), mock.patch("mu.modes.base.os.name", "nt"):
+        assert mm.find_device() == ("COM1", "54321")
+
+
 def test_micropython_mode_find_device_no_ports():
     """
     There are no connected devices so return None.
@@ -706,6 +802,19 @@ def test_StuduinoBitFileManager_on_start_fails():
     fm.on_list_fail.emit.assert_called_once_with()
 
 
+def test_StuduinoBitFileManager_close():
+    """
+    Ensure the serial connection is closed, and only once.
+    """
+    fm = StuduinoBitFileManager("/dev/ttyUSB0")
+    serial = mock.MagicMock()
+    fm.serial = serial
+    fm.close()
+    fm.close()
+    serial.close.assert_called_once_with()
+    assert fm.serial is None
+
+
 def test_StuduinoBitFileManager_put():
     """
     The on_put_file signal is emitted with the name of the effected file when
@@ -28,6 +28,9 @@ def test_StuduinoBitMode_init():
     editor = mock.MagicMock()
     view = mock.MagicMock()
     studuinobit_mode = StuduinoBitMode(editor, view)
+    view.serial_disconnected.connect.assert_called_once_with(
+        studuinobit_mode.is_connecting
+    )
     assert studuinobit_mode.name == _("Artec Studuino:Bit MicroPython")
     assert studuinobit_mode.description is not None
     assert studuinobit_mode.icon == "studuinobit"
@@ -51,6 +54,13 @@ def test_StuduinoBitMode_actions(studuinobit_mode):
     assert actions[4]["handler"] == studuinobit_mode.toggle_plotter
 
 
+def test_StuduinoBitMode_actions_built_once(studuinobit_mode):
+    """
+    The same list of actions is returned each time they're asked for.
+    """
+    assert studuinobit_mode.actions() is studuinobit_mode.actions()
+
+
 def test_api(studuinobit_mode):
     """
     Ensure the right thing comes back from the API.
@@ -114,6 +124,23 @@ def test_remove_fs(studuinobit_mode):
     assert studuinobit_mode.fs is None
 
 
+def test_remove_fs_closes_connection(studuinobit_mode):
+    """
+    The file manager's thread is stopped and its serial connection closed.
+    """
+    studuinobit_mode.fs = True
+    thread = mock.MagicMock()
+    file_manager = mock.MagicMock()
+    studuinobit_mode.file_manager_thread = thread
+    studuinobit_mode.file_manager = file_manager
+    studuinobit_mode.remove_fs()
+    thread.quit.assert_called_once_with()
+    thread.wait.assert_called_once_with()
+    file_manager.close.assert_called_once_with()
+    assert studuinobit_mode.file_manager is None
+    assert studuinobit_mode.file_manager_thread is None
+
+
 def test_toggle_repl_on(studuinobit_mode):
     """
     Ensure the REPL is able to toggle on if there's no file system pane.
@@ -335,6 +362,28 @@ def test_run(studuinobit_mode):
     # studuinobit_mode.set_buttons.assert_called_once_with(files_sb=False)
 
 
+def test_run_sends_script_lines(studuinobit_mode):
+    """
+    Ensure the script in the current tab is sent to the REPL line by line,
+    whatever the line endings, and only split at the end of a line.
+    """
+    studuinobit_mode.initialize = mock.MagicMock()
+    studuinobit_mode.repl = False
+    studuinobit_mode.plotter = False
+
+    def toggle_repl(event):
+        studuinobit_mode.repl = True
+
+    studuinobit_mode.toggle_repl = mock.MagicMock(side_effect=toggle_repl)
+    studuinobit_mode.view.current_tab.text.return_value = (
+        "a = 1\r\nb = '\x0c\u2028'\n"
+    )
+    studuinobit_mode.run()
+    studuinobit_mode.view.repl_pane.send_commands.assert_called_once_with(
+        ["a = 1", "b = '\x0c\u2028'", ""]
+    )
+
+
 def test_on_data_flood(studuinobit_mode):
     """
     Ensure the "Files" button is re-enabled before calling the base method.
@@ -404,6 +453,233 @@ def test_toggle_plotter_with_fs(studuinobit_mode):
     assert studuinobit_mode.view.show_message.call_count == 1
 
 
+def test_read_until(studuinobit_mode):
+    """
+    Ensure reading stops once the token has arrived, even when it is split
+    across reads.
+    """
+    serial = mock.MagicMock()
+    serial.bytesAvailable.side_effect = [0, 1, 0]
+    serial.waitForReadyRead.return_value = True
+    serial.readAll.side_effect = [
+        b"lots of boot output >",
+        b">",
+        b"> ",
+        b"never read",
+    ]
+    studuinobit_mode.read_until(serial, b">>> ")
+    assert serial.readAll.call_count == 3
+    # No need to wait when there's already data to read.
+    assert serial.waitForReadyRead.call_count == 2
+
+
+def test_read_until_short_reads(studuinobit_mode):
+    """
+    The token is found when it arrives a byte at a time after a long banner.
+    """
+    serial = mock.MagicMock()
+    serial.bytesAvailable.return_value = 1
+    serial.readAll.side_effect = [b"x" * 1000] + [bytes([b]) for b in b">>> "]
+    studuinobit_mode.read_until(serial, b">>> ")
+    assert serial.readAll.call_count == 5
+
+
+def test_read_until_timeout(studuinobit_mode):
+    """
+    If the token never arrives, a TimeoutError is raised.
+    """
+    serial = mock.MagicMock()
+    serial.bytesAvailable.return_value = 0
+    serial.waitForReadyRead.return_value = False
+    with pytest.raises(TimeoutError):
+        studuinobit_mode.read_until(serial, b">>> ")
+
+
+def test_find_device_cached(studuinobit_mode):
+    """
+    A device found moments ago is returned without searching again, but is
+    searched for once the cache has expired.
+    """
+    studuinobit_mode.port_path = lambda port_name: port_name
+    ports = [(0x20A0, 0x4269, "COM1", "123")]
+    with mock.patch(
+        "mu.modes.studuinobit.MicroPythonMode.find_device",
+        return_value=("COM1", "123"),
+    ) as mock_find, mock.patch(
+        "mu.modes.studuinobit.get_available_ports", return_value=ports
+    ), mock.patch(
+        "mu.modes.studuinobit.time.monotonic", side_effect=[10, 11, 13]
+    ):
+        assert studuinobit_mode.find_device() == ("COM1", "123")
+        assert studuinobit_mode.find_device() == ("COM1", "123")
+        assert mock_find.call_count == 1
+        assert studuinobit_mode.find_device() == ("COM1", "123")
+        assert mock_find.call_count == 2
+
+
+def test_find_device_cached_port_gone(studuinobit_mode):
+    """
+    A cached device whose port has gone is searched for again.
+    """
+    studuinobit_mode.port_path = lambda port_name: port_name
+    studuinobit_mode.device_cache = ("COM1", "123", 10)
+    with mock.patch(
+        "mu.modes.studuinobit.MicroPythonMode.find_device",
+        return_value=(None, None),
+    ) as mock_find, mock.patch(
+        "mu.modes.studuinobit.get_available_ports", return_value=[]
+    ), mock.patch(
+        "mu.modes.studuinobit.time.monotonic", return_value=11
+    ):
+        assert studuinobit_mode.find_device() == (None, None)
+    mock_find.assert_called_once_with(True)
+    assert studuinobit_mode.device_cache is None
+
+
+def test_find_device_without_logging_not_cached(studuinobit_mode):
+    """
+    The quiet check for plugged in devices always searches and neither
+    uses nor refreshes the cache.
+    """
+    studuinobit_mode.device_cache = ("COM1", "123", 10)
+    with mock.patch(
+        "mu.modes.studuinobit.MicroPythonMode.find_device",
+        return_value=(None, None),
+    ) as mock_find:
+        assert studuinobit_mode.find_device(with_logging=False) == (
+            None,
+            None,
+        )
+    mock_find.assert_called_once_with(False)
+    assert studuinobit_mode.device_cache == ("COM1", "123", 10)
+
+
+def test_find_device_not_found_not_cached(studuinobit_mode):
+    """
+    Not finding the device isn't remembered.
+    """
+    with mock.patch(
+        "mu.modes.studuinobit.MicroPythonMode.find_device",
+        return_value=(None, None),
+    ) as mock_find:
+        assert studuinobit_mode.find_device() == (None, None)
+        assert studuinobit_mode.find_device() == (None, None)
+        assert mock_find.call_count == 2
+    assert studuinobit_mode.device_cache is None
+
+
+def test_open_serial_link(studuinobit_mode):
+    """
+    The port is opened and set up without writing anything to the device.
+    """
+    with mock.patch("mu.modes.studuinobit.QSerialPort") as mock_serial:
+        port = mock_serial.return_value
+        port.open.return_value = True
+        port.isDataTerminalReady.return_value = True
+        studuinobit_mode.open_serial_link("COM1")
+    port.setBaudRate.assert_called_once_with(115200)
+    port.setReadBufferSize.assert_called_once_with(0)
+    assert port.write.call_count == 0
+    assert port.waitForReadyRead.call_count == 0
+
+
+def test_open_serial_link_DTR_unset(studuinobit_mode):
+    """
+    If DTR is unset fall back to PySerial to set it.
+    """
+    with mock.patch(
+        "mu.modes.studuinobit.QSerialPort"
+    ) as mock_serial, mock.patch(
+        "mu.modes.studuinobit.Serial"
+    ) as mock_pyserial:
+        port = mock_serial.return_value
+        port.open.return_value = True
+        port.isDataTerminalReady.return_value = False
+        studuinobit_mode.open_serial_link("COM1")
+    mock_pyserial.assert_called_once_with("COM1")
+    port.close.assert_called_once_with()
+    assert port.open.call_count == 2
+
+
+def test_open_serial_link_fail_forgets_device(studuinobit_mode):
+    """
+    If the port can't be opened, the cached device is forgotten.
+    """
+    studuinobit_mode.device_cache = ("COM1", "123", 10)
+    with mock.patch("mu.modes.studuinobit.QSerialPort") as mock_serial:
+        mock_serial.return_value.open.return_value = False
+        with pytest.raises(IOError):
+            studuinobit_mode.open_serial_link("COM1")
+    assert studuinobit_mode.device_cache is None
+
+
+def test_initialize(studuinobit_mode):
+    """
+    Ensure the device is rebooted and the start slot is reset with a single
+    command.
+    """
+    studuinobit_mode.find_device = mock.MagicMock(return_value=("COM1", "1"))
+    studuinobit_mode.open_serial_link = mock.MagicMock()
+    studuinobit_mode.serial = mock.MagicMock()
+    studuinobit_mode.reboot_and_prompt = mock.MagicMock()
+    with mock.patch("mu.modes.studuinobit.sbfs") as mock_sbfs:
+        assert studuinobit_mode.initialize() is True
+        mock_sbfs.execute.assert_called_once_with(
+            ['import machine\nmachine.nvs_setint("lastSelected", 99)'],
+            mock.ANY,
+        )
+    assert studuinobit_mode.serial is None
+
+
+def test_reset_last_selected(studuinobit_mode):
+    """
+    Slot 99 is selected on the given serial link.
+    """
+    serial = mock.MagicMock()
+    with mock.patch("mu.modes.studuinobit.sbfs") as mock_sbfs:
+        studuinobit_mode.reset_last_selected(serial)
+    mock_sbfs.execute.assert_called_once_with(
+        ['import machine\nmachine.nvs_setint("lastSelected", 99)'], serial
+    )
+
+
+def test_reboot(studuinobit_mode):
+    """
+    Ensure the reset command is only sent once the raw REPL is ready and the
+    rebooted device's banner is waited for.
+    """
+    serial = mock.MagicMock()
+    studuinobit_mode.read_until = mock.MagicMock()
+    studuinobit_mode.reboot(serial)
+    assert serial.write.call_args_list == [
+        mock.call(b"\x03"),
+        mock.call(b"\x01"),
+        mock.call(b"import machine\r\nmachine.reset()\r\n\x04"),
+    ]
+    # Each write is flushed as soon as it's made.
+    assert serial.flush.call_count == 3
+    serial.waitForBytesWritten.assert_called_once_with(1000)
+    assert studuinobit_mode.read_until.call_args_list == [
+        mock.call(serial, b">>> "),
+        mock.call(serial, b"raw REPL; CTRL-B to exit\r\n>"),
+        mock.call(serial, b"Execute last selected script."),
+    ]
+
+
+def test_reboot_and_prompt(studuinobit_mode):
+    """
+    After rebooting, the device is interrupted to get a prompt.
+    """
+    serial = mock.MagicMock()
+    studuinobit_mode.reboot = mock.MagicMock()
+    studuinobit_mode.read_until = mock.MagicMock()
+    studuinobit_mode.reboot_and_prompt(serial)
+    studuinobit_mode.reboot.assert_called_once_with(serial)
+    serial.write.assert_called_once_with(b"\x03")
+    serial.flush.assert_called_once_with()
+    studuinobit_mode.read_until.assert_called_once_with(serial, b">>> ")
+
+
 def test_toggle_flash_on(studuinobit_mode):
     """
     If the fs is off, toggle it on.
@@ -444,6 +720,31 @@ def test_toggle_flash_on(studuinobit_mode):
         )
 
 
+def test_toggle_flash_save(studuinobit_mode):
+    """
+    The script is saved for the selected slot with save_and_encode.
+    """
+    studuinobit_mode.find_device = mock.MagicMock(return_value=("COM1", "1"))
+    studuinobit_mode.open_serial_link = mock.MagicMock()
+    studuinobit_mode.serial = mock.MagicMock()
+    studuinobit_mode.reboot = mock.MagicMock()
+    studuinobit_mode.reboot_and_prompt = mock.MagicMock()
+    studuinobit_mode.view.current_tab.text.return_value = "a = 1"
+    studuinobit_mode.view.current_tab.newline = "\r\n"
+    with mock.patch(
+        "mu.modes.studuinobit.RegisterWindow"
+    ) as mock_rw, mock.patch("mu.modes.studuinobit.sbfs"), mock.patch(
+        "mu.modes.studuinobit.save_and_encode"
+    ) as mock_save:
+        mock_rw.return_value.exec.return_value = 1
+        mock_rw.return_value.get_register_info.return_value = [2]
+        studuinobit_mode.toggle_flash(None)
+    text, usr_file, newline = mock_save.call_args[0]
+    assert text == "a = 1"
+    assert usr_file.endswith("usr2.py")
+    assert newline == "\r\n"
+
+
 def test_toggle_flash_on_cancel(studuinobit_mode):
     """
     If the fs is off, toggle it on.
@@ -591,6 +892,36 @@ def test_studuinobit_mode_toggle_repl_on():
     assert sbm.add_repl.call_count == 1
 
 
+def test_is_connecting_disconnected(studuinobit_mode):
+    """
+    When the device goes away, the REPL and plotter are closed and the user
+    is told why.
+    """
+    studuinobit_mode.repl = True
+    studuinobit_mode.plotter = True
+    studuinobit_mode.device_cache = ("COM1", "123", 10)
+    studuinobit_mode.toggle_repl = mock.MagicMock()
+    studuinobit_mode.toggle_plotter = mock.MagicMock()
+    studuinobit_mode.is_connecting()
+    assert studuinobit_mode.device_cache is None
+    studuinobit_mode.toggle_repl.assert_called_once_with(None)
+    studuinobit_mode.toggle_plotter.assert_called_once_with(None)
+    assert studuinobit_mode.view.show_message.call_count == 1
+
+
+def test_is_connecting_not_in_use(studuinobit_mode):
+    """
+    If neither the REPL nor the plotter were using the device, nothing
+    happens.
+    """
+    studuinobit_mode.repl = False
+    studuinobit_mode.plotter = False
+    studuinobit_mode.toggle_repl = mock.MagicMock()
+    studuinobit_mode.is_connecting()
+    assert studuinobit_mode.toggle_repl.call_count == 0
+    assert studuinobit_mode.view.show_message.call_count == 0
+
+
 def test_registerwindow_init():
     """
     Sanity check for setting up the mode.
@@ -599,15 +930,36 @@ def test_registerwindow_init():
     assert rw.register_info == []
 
 
+def test_registerwindow_buttons():
+    """
+    Ensure there's a transfer button for each of the ten slots, laid out in
+    two columns.
+    """
+    rw = RegisterWindow()
+    assert len(rw.buttons.buttons()) == 10
+    assert rw.buttons.id(rw.buttons.buttons()[7]) == 7
+    grid = rw.layout()
+    assert grid.itemAtPosition(4, 0).widget().title() == "4"
+    assert grid.itemAtPosition(2, 3).widget().title() == "7"
+
+
+def test_registerwindow_button_clicked():
+    """
+    Clicking a transfer button selects its slot.
+    """
+    rw = RegisterWindow()
+    rw.accept = mock.MagicMock()
+    rw.buttons.button(3).click()
+    rw.accept.assert_called_once_with()
+    assert rw.get_register_info() == [3]
+
+
 def test_registerwindow_on_click():
     rw = RegisterWindow()
 
-    rw.sender = mock.MagicMock(return_value=mock.MagicMock())
-    rw.sender().parent = mock.MagicMock(return_value=mock.MagicMock())
-    rw.sender().parent().title.return_value = "1"
     rw.accept = mock.MagicMock()
-    rw.on_click()
+    rw.on_click(1)
     rw.accept.assert_called_once_with()
 
     info = rw.get_register_info()
-    assert info == ["1"]
+    assert info == [1]
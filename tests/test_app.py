@@ -134,7 +134,8 @@ def test_run():
         assert ed.call_count == 1
         assert len(ed.mock_calls) == 3
         assert win.call_count == 1
-        assert len(win.mock_calls) == 6
+        # Includes the Studuino:bit mode watching for serial disconnects.
+        assert len(win.mock_calls) == 7
         assert ex.call_count == 1
         window.load_theme.emit("day")
         qa.assert_has_calls([mock.call().setStyleSheet(DAY_STYLE)])